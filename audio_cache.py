@@ -0,0 +1,248 @@
+import os
+import json
+import hashlib
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', os.path.join(os.getcwd(), 'cache', 'audio'))
+AUDIO_CACHE_MEMORY_ITEMS = int(os.getenv('AUDIO_CACHE_MEMORY_ITEMS', '256'))
+AUDIO_CACHE_MEMORY_BYTES = int(os.getenv('AUDIO_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+AUDIO_CACHE_DISK_BYTES = int(os.getenv('AUDIO_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+AUDIO_CACHE_FILE_IDS = int(os.getenv('AUDIO_CACHE_FILE_IDS', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(text: str, voice_id: str, emotion: str, speed: float, audio_format: str = 'mp3') -> str:
+    """Ключ кэша - хэш всех параметров генерации"""
+    params = json.dumps(
+        [text, voice_id, emotion, round(float(speed), 3), audio_format],
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """Двухуровневый кэш синтезированного аудио (LRU в памяти + диск) и Telegram file_id"""
+
+    def __init__(self, cache_dir: str = AUDIO_CACHE_DIR,
+                 memory_items: int = AUDIO_CACHE_MEMORY_ITEMS,
+                 memory_bytes: int = AUDIO_CACHE_MEMORY_BYTES,
+                 disk_bytes: int = AUDIO_CACHE_DISK_BYTES,
+                 max_file_ids: int = AUDIO_CACHE_FILE_IDS):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_file_ids = max_file_ids
+
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._memory_size = 0
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()
+
+        # Индекс дискового уровня: ключ -> размер, в порядке последнего обращения
+        self._disk: 'OrderedDict[str, int]' = OrderedDict()
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self._disk_loaded = False
+
+        self.counters: Dict[str, int] = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'file_id_hits': 0,
+            'misses': 0,
+        }
+
+    # ---------- Telegram file_id ----------
+
+    async def get_file_ids(self, key: str) -> Optional[List[str]]:
+        """file_id уже загруженных в Telegram голосовых сообщений (по одному на часть)"""
+        file_ids = self._file_ids.get(key)
+        if file_ids is None:
+            data = await asyncio.to_thread(self._disk_read, key + '.fid')
+            if not data:
+                return None
+            file_ids = data.decode('utf-8')
+            self._remember_file_ids(key, file_ids)
+        else:
+            self._file_ids.move_to_end(key)
+        self.counters['file_id_hits'] += 1
+        return file_ids.split('\n')
+
+    async def has_file_ids(self, key: str) -> bool:
+        """Есть ли file_id для ключа; проверка не учитывается в статистике"""
+        if key in self._file_ids:
+            return True
+        return await asyncio.to_thread(self._disk_contains, key + '.fid')
+
+    async def set_file_ids(self, key: str, file_ids: List[str]):
+        value = '\n'.join(file_ids)
+        self._remember_file_ids(key, value)
+        evicted = await asyncio.to_thread(self._disk_write, key + '.fid', value.encode('utf-8'))
+        self._forget_evicted(evicted)
+
+    async def forget_file_ids(self, key: str):
+        """Удаление file_id, которые Telegram больше не принимает"""
+        self._file_ids.pop(key, None)
+        await asyncio.to_thread(self._disk_remove, key + '.fid')
+
+    def _remember_file_ids(self, key: str, file_ids: str):
+        self._file_ids[key] = file_ids
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    def _forget_evicted(self, evicted: List[str]):
+        for name in evicted:
+            if name.endswith('.fid'):
+                self._file_ids.pop(name[:-4], None)
+
+    # ---------- Аудио ----------
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Поиск аудио сначала в памяти, затем на диске"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return data
+
+        data = await asyncio.to_thread(self._disk_read, key + '.bin')
+        if data is not None:
+            self.counters['disk_hits'] += 1
+            self._memory_put(key, data)
+            return data
+
+        self.counters['misses'] += 1
+        return None
+
+    async def put(self, key: str, data: bytes):
+        """Сохранение аудио в оба уровня кэша"""
+        self._memory_put(key, data)
+        evicted = await asyncio.to_thread(self._disk_write, key + '.bin', data)
+        self._forget_evicted(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        hits = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['file_id_hits']
+        lookups = hits + self.counters['misses']
+        return {
+            **self.counters,
+            'lookups': lookups,
+            'hit_rate_percent': round(100 * hits / lookups) if lookups else 0,
+            'memory_items': len(self._memory),
+            'memory_bytes': self._memory_size,
+            'disk_items': len(self._disk),
+            'disk_bytes': self._disk_size,
+            'file_ids': len(self._file_ids),
+        }
+
+    def _memory_put(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while len(self._memory) > self.memory_items or self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    # ---------- Дисковый уровень (выполняется в отдельном потоке) ----------
+    # Индекс хранит имена файлов (<ключ>.bin - аудио, <ключ>.fid - file_id)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def _load_disk_index(self):
+        """Сканирование каталога кэша при первом обращении"""
+        if self._disk_loaded:
+            return
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith(('.bin', '.fid')):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+        self._disk_loaded = True
+
+    def _disk_contains(self, name: str) -> bool:
+        with self._disk_lock:
+            self._load_disk_index()
+            return name in self._disk
+
+    def _disk_read(self, name: str) -> Optional[bytes]:
+        with self._disk_lock:
+            self._load_disk_index()
+            if name not in self._disk:
+                return None
+            self._disk.move_to_end(name)
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._disk_lock:
+                size = self._disk.pop(name, None)
+                if size is not None:
+                    self._disk_size -= size
+            return None
+
+    def _disk_write(self, name: str, data: bytes) -> List[str]:
+        """Запись на диск; возвращает имена вытесненных файлов"""
+        if len(data) > self.disk_bytes:
+            return []
+        path = self._path(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Cannot write audio cache entry {name}: {e}")
+            return []
+
+        with self._disk_lock:
+            self._load_disk_index()
+            old = self._disk.pop(name, None)
+            if old is not None:
+                self._disk_size -= old
+            self._disk[name] = len(data)
+            self._disk_size += len(data)
+            evicted = []
+            while self._disk_size > self.disk_bytes and self._disk:
+                old_name, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_name)
+
+        for old_name in evicted:
+            try:
+                os.unlink(self._path(old_name))
+            except OSError:
+                pass
+        return evicted
+
+    def _disk_remove(self, name: str):
+        with self._disk_lock:
+            size = self._disk.pop(name, None)
+            if size is not None:
+                self._disk_size -= size
+        try:
+            os.unlink(self._path(name))
+        except OSError:
+            pass
@@ -0,0 +1,110 @@
+import io
+import os
+import csv
+import zipfile
+from typing import BinaryIO, List, Optional, Tuple
+
+from media import media_buffer
+
+BATCH_MAX_FILE_BYTES = int(os.getenv('BATCH_MAX_FILE_BYTES', str(1024 * 1024)))
+BATCH_MAX_LINES = int(os.getenv('BATCH_MAX_LINES', '500'))
+BATCH_LINE_MAX_CHARS = int(os.getenv('BATCH_LINE_MAX_CHARS', '1000'))
+# Сколько строк пакета одного пользователя синтезируется одновременно
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+# Не чаще, чем раз в столько секунд, обновляется сообщение о прогрессе
+BATCH_PROGRESS_INTERVAL = float(os.getenv('BATCH_PROGRESS_INTERVAL', '5'))
+# Архив больше этого размера отправляется частями (лимит Bot API на документ - 50 МБ)
+BATCH_MAX_ZIP_BYTES = int(os.getenv('BATCH_MAX_ZIP_BYTES', str(45 * 1024 * 1024)))
+
+BATCH_EXTENSIONS = ('txt', 'csv')
+
+
+class BatchRejected(Exception):
+    """Файл пакета непригоден; текст исключения показывается пользователю"""
+
+
+def _decode(raw: bytes) -> str:
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise BatchRejected("❌ Не удалось прочитать файл. Сохраните его в кодировке UTF-8")
+
+
+def _csv_rows(content: str) -> List[List[str]]:
+    try:
+        dialect = csv.Sniffer().sniff(content[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(content), dialect) if row and any(cell.strip() for cell in row)]
+    # Строка заголовка необязательна
+    if rows and rows[0][0].strip().lower() in ('text', 'текст'):
+        rows = rows[1:]
+    return rows
+
+
+def parse_batch(buffer: BinaryIO, file_ext: str) -> List[Tuple[str, Optional[str]]]:
+    """Строки пакета: (текст, стиль или None).
+
+    .txt - одна фраза на строку, .csv - колонки text и необязательная style.
+    Блокирующая функция - вызывать через asyncio.to_thread.
+    """
+    buffer.seek(0)
+    content = _decode(buffer.read())
+
+    if file_ext == 'csv':
+        lines = [
+            (row[0].strip(), row[1].strip().lower() if len(row) > 1 and row[1].strip() else None)
+            for row in _csv_rows(content)
+        ]
+    else:
+        lines = [(line.strip(), None) for line in content.splitlines()]
+    lines = [(text, style) for text, style in lines if text]
+
+    if not lines:
+        raise BatchRejected("❌ В файле нет строк для озвучивания")
+    if len(lines) > BATCH_MAX_LINES:
+        raise BatchRejected(f"❌ Слишком много строк: {len(lines)} (максимум {BATCH_MAX_LINES})")
+    for number, (text, _) in enumerate(lines, 1):
+        if len(text) > BATCH_LINE_MAX_CHARS:
+            raise BatchRejected(
+                f"❌ Строка {number} слишком длинная (максимум {BATCH_LINE_MAX_CHARS} символов)"
+            )
+    return lines
+
+
+class BatchArchive:
+    """Zip-архив, который пополняется по мере готовности клипов.
+
+    Клипы сразу записываются в буфер (крупный архив уходит на диск сам),
+    в памяти держится только текущий клип. Методы блокирующие.
+    """
+
+    def __init__(self):
+        self.buffer = media_buffer()
+        self._zip = zipfile.ZipFile(self.buffer, 'w', compression=zipfile.ZIP_STORED)
+        self.entries = 0
+        self.total = 0
+
+    @property
+    def size(self) -> int:
+        return self.total or self.buffer.tell()
+
+    def add(self, name: str, data: bytes):
+        # MP3 почти не сжимается - храним без сжатия
+        self._zip.writestr(name, data)
+        self.entries += 1
+
+    def add_text(self, name: str, text: str):
+        self._zip.writestr(zipfile.ZipInfo(name), text.encode('utf-8'), compress_type=zipfile.ZIP_DEFLATED)
+
+    def finish(self) -> BinaryIO:
+        """Запись оглавления; возвращает буфер архива с позицией в начале"""
+        self._zip.close()
+        self.total = self.buffer.tell()
+        self.buffer.seek(0)
+        return self.buffer
+
+    def close(self):
+        self.buffer.close()
@@ -0,0 +1,382 @@
+"""Локальные заглушки MiniMax, Telegram Bot API и Redis для нагрузочного тестирования.
+
+Можно запустить отдельно и направить на них настоящего бота:
+
+    python -m bench.fakes --minimax-port 8701 --telegram-port 8702 --redis-port 8703
+    MINIMAX_API_BASE=http://127.0.0.1:8701 TELEGRAM_API_URL=http://127.0.0.1:8702 \
+        SESSION_BACKEND=redis SESSION_REDIS_URL=redis://127.0.0.1:8703/0 python bot.py
+"""
+import io
+import time
+import wave
+import zlib
+import base64
+import fnmatch
+import random
+import shutil
+import asyncio
+import argparse
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+SAMPLE_RATE = 24000
+
+
+def tone_pcm(seconds: float, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Синтетическая "речь": тон с гармониками и слогами по 200 мс"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = 0.4 * np.sin(2 * np.pi * 180 * t) + 0.2 * np.sin(2 * np.pi * 360 * t)
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 2.5 * t)
+    return (signal * envelope * 32767 * 0.7).astype(np.int16)
+
+
+def wav_bytes(pcm: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def mp3_bytes(size: int) -> bytes:
+    """MP3 примерно заданного размера (64 кбит/с); без ffmpeg - случайные байты"""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        pcm = tone_pcm(max(size / 8000, 0.5))
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 's16le', '-ar', str(SAMPLE_RATE),
+             '-ac', '1', '-i', 'pipe:0', '-b:a', '64k', '-f', 'mp3', 'pipe:1'],
+            input=pcm.tobytes(), capture_output=True
+        )
+        if result.returncode == 0:
+            return result.stdout
+    return random.randbytes(size)
+
+
+async def _delay(latency: float, jitter: float):
+    if latency > 0:
+        await asyncio.sleep(max(random.gauss(latency, latency * jitter), 0))
+
+
+class FakeMiniMax:
+    """Заглушка эндпоинтов voice_clone и t2a_v2 с настраиваемыми задержками и ошибками"""
+
+    def __init__(self, clone_latency: float = 1.0, tts_latency: float = 0.5, jitter: float = 0.2,
+                 error_rate: float = 0.0, tts_bytes: int = 40000, slow_rate: float = 0.0,
+                 slow_factor: float = 10.0, outage_start: float = 0.0, outage_duration: float = 0.0):
+        self.clone_latency = clone_latency
+        self.tts_latency = tts_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # Доля ответов, задержанных в slow_factor раз (хвост задержек)
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        # Окно полной недоступности (503), секунды от запуска
+        self.outage_start = outage_start
+        self.outage_duration = outage_duration
+        self.started = time.monotonic()
+        self.audio = base64.b64encode(mp3_bytes(tts_bytes)).decode()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+
+    def _latency(self, latency: float) -> float:
+        return latency * self.slow_factor if random.random() < self.slow_rate else latency
+
+    def _fail(self) -> Optional[web.Response]:
+        elapsed = time.monotonic() - self.started
+        if self.outage_duration and self.outage_start <= elapsed < self.outage_start + self.outage_duration:
+            self.errors += 1
+            return web.json_response({'error': 'service unavailable'}, status=503)
+        if random.random() >= self.error_rate:
+            return None
+        self.errors += 1
+        if random.random() < 0.5:
+            return web.json_response({'error': 'rate limited'}, status=429, headers={'Retry-After': '1'})
+        return web.json_response({'error': 'internal error'}, status=500)
+
+    async def voice_clone(self, request: web.Request) -> web.Response:
+        self.requests['voice_clone'] = self.requests.get('voice_clone', 0) + 1
+        payload = await request.json()
+        await _delay(self._latency(self.clone_latency), self.jitter)
+        failure = self._fail()
+        if failure is not None:
+            return failure
+        digest = zlib.crc32(payload.get('audio_data', '').encode())
+        return web.json_response({'voice_id': f"bench_{digest:08x}"})
+
+    async def tts(self, request: web.Request) -> web.Response:
+        self.requests['t2a_v2'] = self.requests.get('t2a_v2', 0) + 1
+        await request.read()
+        await _delay(self._latency(self.tts_latency), self.jitter)
+        failure = self._fail()
+        if failure is not None:
+            return failure
+        return web.json_response({'audio_data': self.audio})
+
+    def add_routes(self, app: web.Application):
+        app.router.add_post('/v1/voice_clone', self.voice_clone)
+        app.router.add_post('/v1/t2a_v2', self.tts)
+
+
+class FakeTelegram:
+    """Заглушка Bot API: принимает исходящие вызовы бота и отдает файлы образцов.
+
+    on_event(chat_id, method, text) вызывается для каждого сообщения, отправленного ботом.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.2, sample_seconds: float = 8.0,
+                 on_event: Optional[Callable[[int, str, str], None]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.on_event = on_event
+        self.sample = wav_bytes(tone_pcm(sample_seconds))
+        self._message_id = 0
+        self.requests: Dict[str, int] = {}
+
+    def _message(self, chat_id: int, **fields) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        message.update(fields)
+        return message
+
+    def _sample_for(self, file_id: str) -> bytes:
+        # Разные file_id - разное содержимое (и отпечаток), без генерации звука заново
+        header = 44
+        marker = zlib.crc32(file_id.encode()).to_bytes(4, 'little')
+        return self.sample[:header] + marker + self.sample[header + len(marker):]
+
+    def _emit(self, chat_id: int, method: str, text: str = ''):
+        if self.on_event is not None:
+            self.on_event(chat_id, method, text)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = await request.post()
+        await _delay(self.latency, self.jitter)
+
+        chat_id = int(params.get('chat_id') or 0)
+        if method == 'getMe':
+            result: Any = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            text = params.get('text', '')
+            self._emit(chat_id, method, text)
+            result = self._message(chat_id, text=text)
+        elif method == 'sendVoice':
+            voice = params.get('voice')
+            size = len(voice.file.read()) if hasattr(voice, 'file') else 0
+            self._emit(chat_id, method, str(size))
+            file_id = f"voice-{self._message_id + 1}"
+            result = self._message(chat_id, voice={
+                'file_id': file_id, 'file_unique_id': file_id, 'duration': 1, 'file_size': size
+            })
+        elif method == 'sendDocument':
+            document = params.get('document')
+            size = len(document.file.read()) if hasattr(document, 'file') else 0
+            self._emit(chat_id, method, str(size))
+            file_id = f"document-{self._message_id + 1}"
+            result = self._message(chat_id, document={
+                'file_id': file_id, 'file_unique_id': file_id, 'file_size': size
+            })
+        elif method == 'getFile':
+            file_id = params.get('file_id', '')
+            result = {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self.sample),
+                'file_path': f"voice/{file_id}.wav"
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.requests['file'] = self.requests.get('file', 0) + 1
+        await _delay(self.latency, self.jitter)
+        file_id = request.match_info['path'].rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        return web.Response(body=self._sample_for(file_id), content_type='audio/wav')
+
+    def add_routes(self, app: web.Application):
+        app.router.add_post(r'/bot{token}/{method}', self.handle_method)
+        app.router.add_get(r'/file/bot{token}/{path:.+}', self.handle_file)
+
+
+class FakeRedis:
+    """Сервер с протоколом Redis (RESP2) в памяти: команды, которые использует
+    RedisSessionBackend - GET, SET с EX, DEL, SCAN, а также PING и служебные CLIENT/SELECT.
+    """
+
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.requests: Dict[str, int] = {}
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and time.monotonic() >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, bool):
+            return b'+OK\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, Exception):
+            return f"-ERR {value}\r\n".encode()
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedis._encode(item) for item in value)
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def execute(self, command: List[bytes]) -> Any:
+        name = command[0].decode().upper()
+        args = command[1:]
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if name == 'PING':
+            return b'PONG'
+        if name in ('CLIENT', 'SELECT'):
+            return True
+        if name == 'GET':
+            return self._get(args[0])
+        if name == 'SET':
+            expires = None
+            options = [arg.decode().upper() for arg in args[2:]]
+            if 'EX' in options:
+                expires = time.monotonic() + float(options[options.index('EX') + 1])
+            self.data[args[0]] = (args[1], expires)
+            return True
+        if name == 'DEL':
+            removed = [key for key in args if self._get(key) is not None]
+            for key in removed:
+                del self.data[key]
+            return len(removed)
+        if name == 'SCAN':
+            # Все ключи за один проход: курсор всегда 0
+            options = [arg.decode() for arg in args[1:]]
+            pattern = options[options.index('MATCH') + 1] if 'MATCH' in options else '*'
+            keys = [key for key in list(self.data) if self._get(key) is not None
+                    and fnmatch.fnmatchcase(key.decode(errors='replace'), pattern)]
+            return [b'0', keys]
+        return ValueError(f"unknown command '{name}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(b'*'):
+                    command = []
+                    for _ in range(int(line[1:])):
+                        size = int((await reader.readline())[1:])
+                        command.append((await reader.readexactly(size + 2))[:-2])
+                else:
+                    command = line.split()
+                if command:
+                    writer.write(self._encode(self.execute(command)))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def start_site(routes: Any, host: str, port: int) -> web.AppRunner:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    routes.add_routes(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def bound_port(runner: web.AppRunner) -> int:
+    return runner.addresses[0][1]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('fake servers')
+    group.add_argument('--clone-latency', type=float, default=1.0, help='voice_clone latency, s')
+    group.add_argument('--tts-latency', type=float, default=0.5, help='t2a_v2 latency, s')
+    group.add_argument('--telegram-latency', type=float, default=0.05, help='Bot API latency, s')
+    group.add_argument('--jitter', type=float, default=0.2, help='latency stddev as a share of the mean')
+    group.add_argument('--error-rate', type=float, default=0.0, help='share of MiniMax calls failing with 429/500')
+    group.add_argument('--slow-rate', type=float, default=0.0, help='share of MiniMax calls answering slowly')
+    group.add_argument('--slow-factor', type=float, default=10.0, help='latency multiplier for slow calls')
+    group.add_argument('--outage-start', type=float, default=0.0, help='MiniMax outage (503) start, s after launch')
+    group.add_argument('--outage-duration', type=float, default=0.0, help='MiniMax outage length, s (0 - none)')
+    group.add_argument('--tts-bytes', type=int, default=40000, help='size of each synthesized chunk')
+    group.add_argument('--sample-seconds', type=float, default=8.0, help='duration of the voice sample')
+
+
+def build_fakes(args: argparse.Namespace, on_event=None):
+    minimax = FakeMiniMax(args.clone_latency, args.tts_latency, args.jitter, args.error_rate, args.tts_bytes,
+                          args.slow_rate, args.slow_factor, args.outage_start, args.outage_duration)
+    telegram = FakeTelegram(args.telegram_latency, args.jitter, args.sample_seconds, on_event)
+    return minimax, telegram
+
+
+def serve(args: argparse.Namespace, events=None, ready=None):
+    """Запуск заглушек до остановки процесса.
+
+    events - очередь multiprocessing для сообщений бота, ready - очередь для занятых портов.
+    """
+    async def main():
+        on_event = (lambda *event: events.put(event)) if events is not None else None
+        minimax, telegram = build_fakes(args, on_event)
+        minimax_runner = await start_site(minimax, args.host, args.minimax_port)
+        telegram_runner = await start_site(telegram, args.host, args.telegram_port)
+        redis_server = await FakeRedis().start(args.host, args.redis_port)
+        ports = (bound_port(minimax_runner), bound_port(telegram_runner), redis_server.sockets[0].getsockname()[1])
+        if ready is not None:
+            ready.put(ports)
+        else:
+            print(f"MINIMAX_API_BASE=http://{args.host}:{ports[0]}")
+            print(f"TELEGRAM_API_URL=http://{args.host}:{ports[1]}")
+            print(f"SESSION_REDIS_URL=redis://{args.host}:{ports[2]}/0")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await minimax_runner.cleanup()
+            await telegram_runner.cleanup()
+            redis_server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake MiniMax and Telegram Bot API servers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--minimax-port', type=int, default=8701)
+    parser.add_argument('--telegram-port', type=int, default=8702)
+    parser.add_argument('--redis-port', type=int, default=8703)
+    add_arguments(parser)
+    serve(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
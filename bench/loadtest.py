@@ -0,0 +1,405 @@
+"""Нагрузочный тест бота на локальных заглушках MiniMax и Telegram (без сети).
+
+Каждый виртуальный пользователь проходит /start -> образец -> текст -> стиль;
+обновления подаются прямо в Application, ответы бота приходят в заглушку Bot API.
+
+    python -m bench.loadtest --users 2000 --concurrency 300
+    python -m bench.loadtest --users 500 --error-rate 0.05 --json result.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.fakes import add_arguments, serve
+
+STYLES = ('style_neutral', 'style_happy', 'style_sad', 'style_angry', 'style_none', 'speed_fast')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def bucket_quantile(buckets: Tuple[float, ...], counts: List[int], q: float) -> float:
+    """Верхняя граница корзины гистограммы, в которую попадает квантиль q"""
+    total = sum(counts)
+    cumulative = 0
+    for bound, count in zip(buckets + (float('inf'),), counts):
+        cumulative += count
+        if total and cumulative >= q * total:
+            return bound
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoopLagMonitor:
+    """Опоздание пробуждений цикла событий относительно запланированного"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class Stage:
+    """Шаг сценария: обновление от пользователя и признаки завершения по ответам бота"""
+
+    def __init__(self, name: str, build: Callable[['VirtualUser'], Dict[str, Any]], done: str):
+        self.name = name
+        self.build = build
+        self.done = done
+
+    @staticmethod
+    def failed(text: str) -> bool:
+        return text.startswith(('❌', '🚦', '⚠️'))
+
+
+class VirtualUser:
+    def __init__(self, runner: 'LoadTest', index: int):
+        self.runner = runner
+        self.user_id = 10_000_000 + index
+        args = runner.args
+        sample = index % args.distinct_samples if args.distinct_samples else index
+        text = index % args.distinct_texts if args.distinct_texts else index
+        self.sample_id = f"sample-{sample}"
+        self.text = (f"Пользователь {text} проверяет озвучку текста. " * args.text_chars)[:args.text_chars]
+        self.style = runner.random.choice(STYLES)
+        self.events: asyncio.Queue = asyncio.Queue()
+
+    def _user(self) -> Dict[str, Any]:
+        return {'id': self.user_id, 'is_bot': False, 'first_name': 'Bench'}
+
+    def _message(self, **fields) -> Dict[str, Any]:
+        message = {
+            'message_id': self.runner.next_id(),
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self._user(),
+        }
+        message.update(fields)
+        return {'message': message}
+
+    def start_update(self) -> Dict[str, Any]:
+        return self._message(text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}])
+
+    def sample_update(self) -> Dict[str, Any]:
+        return self._message(voice={
+            'file_id': self.sample_id, 'file_unique_id': self.sample_id,
+            'duration': int(self.runner.args.sample_seconds), 'mime_type': 'audio/ogg'
+        })
+
+    def text_update(self) -> Dict[str, Any]:
+        return self._message(text=self.text)
+
+    def style_update(self) -> Dict[str, Any]:
+        return {'callback_query': {
+            'id': str(self.runner.next_id()),
+            'from': self._user(),
+            'chat_instance': str(self.user_id),
+            'data': self.style,
+            'message': {
+                'message_id': self.runner.next_id(),
+                'date': int(time.time()),
+                'chat': {'id': self.user_id, 'type': 'private'},
+                'text': 'Выберите стиль',
+            },
+        }}
+
+    async def _wait(self, stage: Stage, deadline: float) -> bool:
+        while True:
+            method, text = await asyncio.wait_for(self.events.get(), deadline - time.monotonic())
+            if method == 'sendVoice':
+                self.runner.voices += 1
+                self.runner.voice_bytes += int(text or 0)
+            elif stage.done in text:
+                return True
+            elif Stage.failed(text):
+                return False
+
+    async def run(self):
+        for stage in self.runner.stages:
+            data = stage.build(self)
+            data['update_id'] = self.runner.next_id()
+            started = time.monotonic()
+            await self.runner.submit(data)
+            try:
+                ok = await self._wait(stage, started + self.runner.args.step_timeout)
+            except asyncio.TimeoutError:
+                self.runner.record_failure(stage.name, 'timeout')
+                return
+            if not ok:
+                self.runner.record_failure(stage.name, 'error')
+                return
+            self.runner.latencies[stage.name].append(time.monotonic() - started)
+            if self.runner.args.think_time:
+                await asyncio.sleep(self.runner.args.think_time)
+        self.runner.completed += 1
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, application):
+        self.args = args
+        self.application = application
+        self.random = random.Random(args.seed)
+        self.stages = [
+            Stage('start', VirtualUser.start_update, 'Шаг 1/2'),
+            Stage('sample', VirtualUser.sample_update, 'Шаг 2/2'),
+            Stage('text', VirtualUser.text_update, 'Выберите стиль'),
+            Stage('style', VirtualUser.style_update, 'Готово'),
+        ]
+        self.latencies: Dict[str, List[float]] = {stage.name: [] for stage in self.stages}
+        self.failures: Dict[str, int] = {}
+        self.users: Dict[int, VirtualUser] = {}
+        self.completed = 0
+        self.voices = 0
+        self.voice_bytes = 0
+        self._id = 0
+
+    def next_id(self) -> int:
+        self._id += 1
+        return self._id
+
+    def record_failure(self, stage: str, reason: str):
+        key = f"{stage}:{reason}"
+        self.failures[key] = self.failures.get(key, 0) + 1
+
+    def dispatch(self, chat_id: int, method: str, text: str):
+        user = self.users.get(chat_id)
+        if user is not None:
+            user.events.put_nowait((method, text))
+
+    async def submit(self, data: Dict[str, Any]):
+        from telegram import Update
+
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    async def _run_user(self, index: int, semaphore: asyncio.Semaphore):
+        user = VirtualUser(self, index)
+        self.users[user.user_id] = user
+        try:
+            await user.run()
+        except Exception as e:
+            self.record_failure('driver', type(e).__name__)
+        finally:
+            del self.users[user.user_id]
+            semaphore.release()
+
+    async def run(self) -> float:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        tasks = set()
+        started = time.monotonic()
+        for index in range(self.args.users):
+            if self.args.arrival_rate:
+                delay = started + index / self.args.arrival_rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            task = asyncio.create_task(self._run_user(index, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.monotonic() - started
+
+
+def build_report(test: LoadTest, elapsed: float, lag: LoopLagMonitor) -> Dict[str, Any]:
+    from metrics import API_ERRORS, SPECULATION, STAGE_SECONDS
+
+    def summary(values: List[float]) -> Dict[str, float]:
+        return {
+            'count': len(values),
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': max(values, default=0.0),
+        }
+
+    internal = {}
+    for (stage,), (counts, total) in sorted(STAGE_SECONDS._values.items()):
+        count = sum(counts)
+        internal[stage] = {
+            'count': count,
+            'mean': total[0] / count if count else 0.0,
+            'p95_le': bucket_quantile(STAGE_SECONDS.buckets, counts, 0.95),
+            'p99_le': bucket_quantile(STAGE_SECONDS.buckets, counts, 0.99),
+        }
+
+    return {
+        'users': test.args.users,
+        'completed': test.completed,
+        'failures': test.failures,
+        'elapsed_seconds': elapsed,
+        'flows_per_second': test.completed / elapsed if elapsed else 0.0,
+        'updates_per_second': sum(len(v) for v in test.latencies.values()) / elapsed if elapsed else 0.0,
+        'voices_sent': test.voices,
+        'voice_bytes_sent': test.voice_bytes,
+        'stages': {name: summary(values) for name, values in test.latencies.items()},
+        'internal_stages': internal,
+        'minimax_errors': {'/'.join(labels): value for labels, value in API_ERRORS._values.items()},
+        'speculation': {labels[0]: value for labels, value in SPECULATION._values.items()},
+        'loop_lag': summary(lag.samples),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nUsers: {report['users']}, completed: {report['completed']}, "
+          f"elapsed: {report['elapsed_seconds']:.1f}s")
+    print(f"Throughput: {report['flows_per_second']:.2f} flows/s, "
+          f"{report['updates_per_second']:.2f} updates/s, {report['voices_sent']} voices sent")
+    if report['failures']:
+        print("Failures: " + ", ".join(f"{key}={value}" for key, value in sorted(report['failures'].items())))
+
+    print(f"\n{'stage':<24}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, row in report['stages'].items():
+        print(f"{name:<24}{row['count']:>8}{row['p50']:>10.3f}{row['p95']:>10.3f}"
+              f"{row['p99']:>10.3f}{row['max']:>10.3f}")
+
+    if report['internal_stages']:
+        print(f"\n{'bot stage':<24}{'count':>8}{'mean':>10}{'p95<=':>10}{'p99<=':>10}")
+        for name, row in report['internal_stages'].items():
+            print(f"{name:<24}{row['count']:>8}{row['mean']:>10.3f}{row['p95_le']:>10g}{row['p99_le']:>10g}")
+
+    if report['minimax_errors']:
+        print("\nMiniMax errors: " + ", ".join(f"{k}={v:g}" for k, v in report['minimax_errors'].items()))
+
+    if report['speculation']:
+        print("Speculation: " + ", ".join(f"{k}={v:g}" for k, v in sorted(report['speculation'].items())))
+
+    lag = report['loop_lag']
+    print(f"\nEvent loop lag: p50 {lag['p50'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms, "
+          f"max {lag['max'] * 1000:.1f} ms")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+
+def start_fakes(args: argparse.Namespace) -> Tuple[multiprocessing.Process, Any, Tuple[int, int, int]]:
+    """Заглушки работают в отдельном процессе, чтобы не влиять на цикл событий и RSS бота"""
+    context = multiprocessing.get_context('spawn')
+    events = context.Queue()
+    ready = context.Queue()
+    process = context.Process(target=serve, args=(args, events, ready), daemon=True)
+    process.start()
+    ports = ready.get(timeout=60)
+    return process, events, ports
+
+
+def configure_environment(args: argparse.Namespace, ports: Tuple[int, int, int], workdir: str):
+    # Заданные явно переменные нельзя перекрыть значениями из .env
+    os.environ['TELEGRAM_TOKEN'] = '123456:bench'
+    os.environ['MINIMAX_API_KEY'] = 'bench'
+    os.environ['MINIMAX_API_BASE'] = f"http://{args.host}:{ports[0]}"
+    os.environ['TELEGRAM_API_URL'] = f"http://{args.host}:{ports[1]}"
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['SESSION_BACKEND'] = args.session_backend
+    os.environ['SESSION_REDIS_URL'] = f"redis://{args.host}:{ports[2]}/0"
+    os.environ.setdefault('AUDIO_CACHE_DIR', os.path.join(workdir, 'audio'))
+    os.environ.setdefault('VOICE_REGISTRY_DB', os.path.join(workdir, 'voices.sqlite3'))
+    os.environ.setdefault('SESSION_DB', os.path.join(workdir, 'sessions.sqlite3'))
+
+
+async def run_benchmark(args: argparse.Namespace, events) -> Dict[str, Any]:
+    import bot
+
+    application = bot.build_application()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    test = LoadTest(args, application)
+    loop = asyncio.get_running_loop()
+
+    def pump():
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            loop.call_soon_threadsafe(test.dispatch, *event)
+
+    reader = threading.Thread(target=pump, name='bench-events', daemon=True)
+    reader.start()
+
+    lag = LoopLagMonitor()
+    lag.start()
+    try:
+        elapsed = await test.run()
+    finally:
+        lag.stop()
+        events.put(None)
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+    return build_report(test, elapsed, lag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the voice clone bot')
+    parser.add_argument('--users', type=int, default=1000, help='virtual users to run through the flow')
+    parser.add_argument('--concurrency', type=int, default=200, help='users in flight at once')
+    parser.add_argument('--arrival-rate', type=float, default=0.0, help='new users per second (0 - no limit)')
+    parser.add_argument('--think-time', type=float, default=0.0, help='pause between steps, s')
+    parser.add_argument('--step-timeout', type=float, default=300.0, help='max wait for a reply, s')
+    parser.add_argument('--text-chars', type=int, default=200, help='length of the text to synthesize')
+    parser.add_argument('--distinct-samples', type=int, default=0, help='share N samples between users (0 - unique)')
+    parser.add_argument('--distinct-texts', type=int, default=0, help='share N texts between users (0 - unique)')
+    parser.add_argument('--session-backend', choices=('memory', 'sqlite', 'redis'), default='memory',
+                        help='session store of the bot (redis - against the fake RESP server)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--log-level', default='ERROR')
+    add_arguments(parser)
+    args = parser.parse_args()
+    args.minimax_port = args.telegram_port = args.redis_port = 0
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=args.log_level)
+
+    process, events, ports = start_fakes(args)
+    workdir = tempfile.mkdtemp(prefix='voicebot-bench-')
+    try:
+        configure_environment(args, ports, workdir)
+        report = asyncio.run(run_benchmark(args, events))
+    finally:
+        process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0 if report['completed'] == args.users else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,32 +1,87 @@
+import io
 import os
+import csv
+import time
 import logging
+import threading
 import base64
-from typing import Dict, Optional
-import tempfile
+import asyncio
+from typing import BinaryIO, List, Optional, Tuple
 
-import requests
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters
 )
 
 load_dotenv()
 
+# Локальные модули читают настройки из окружения, поэтому импортируются после load_dotenv
+from minimax_client import (  # noqa: E402
+    MINIMAX_MAX_INFLIGHT, MINIMAX_VOICE_MISSING_CODES, MiniMaxClient, CircuitOpen, VoiceMissing
+)
+from audio_cache import AUDIO_CACHE_DIR, AUDIO_CACHE_DISK_BYTES, AudioCache, make_cache_key  # noqa: E402
+from voice_registry import VoiceRegistry  # noqa: E402
+from synthesis import MAX_TEXT_LENGTH, TEXT_JOIN_WINDOW, TEXT_JOIN_MIN_CHARS, split_text, synthesize_chunks, stitch_audio  # noqa: E402
+from transcode import OPUS_ENABLED, to_ogg_opus  # noqa: E402
+from preprocess import SampleRejected, prepare_sample  # noqa: E402
+from sessions import Session, create_session_store  # noqa: E402
+from scheduler import SCHEDULER_CONCURRENCY, JobScheduler, JobCancelled, QueueFull  # noqa: E402
+from speculation import Speculator  # noqa: E402
+from dispatch import PerUserUpdateProcessor, released_slot  # noqa: E402
+from profiling import LOOP_MONITOR_ENABLED, PROFILE_MAX_SECONDS, LoopMonitor, SamplingProfiler  # noqa: E402
+from webhook import WebhookRouter, worker_dir, worker_owns, worker_share  # noqa: E402
+from metrics import (  # noqa: E402
+    MetricsServer, STAGE_SECONDS, API_ERRORS, PAYLOAD_BYTES, UPDATES,
+    ACTIVE_SESSIONS, JOBS_RUNNING, JOBS_QUEUED, MINIMAX_CIRCUIT_OPEN, UPDATES_RUNNING, UPDATE_USERS
+)
+from media import MIME_TYPES, media_buffer, buffer_fingerprint, b64encode_buffer  # noqa: E402
+from batch import (  # noqa: E402
+    BATCH_EXTENSIONS, BATCH_MAX_FILE_BYTES, BATCH_MAX_LINES, BATCH_CONCURRENCY,
+    BATCH_PROGRESS_INTERVAL, BATCH_MAX_ZIP_BYTES, BatchRejected, BatchArchive, parse_batch
+)
+
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+# polling (по умолчанию, для разработки) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
 MINIMAX_API_KEY = os.getenv('MINIMAX_API_KEY')
-MINIMAX_VOICE_CLONE_API = "https://api.minimax.chat/v1/voice_clone"  # Проверьте точный endpoint
-MINIMAX_TTS_API = "https://api.minimax.chat/v1/t2a_v2"
+# Адреса API можно переопределить, например, для локальных заглушек в нагрузочных тестах
+MINIMAX_API_BASE = os.getenv('MINIMAX_API_BASE', 'https://api.minimax.chat').rstrip('/')
+MINIMAX_VOICE_CLONE_API = f"{MINIMAX_API_BASE}/v1/voice_clone"  # Проверьте точный endpoint
+MINIMAX_TTS_API = f"{MINIMAX_API_BASE}/v1/t2a_v2"
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')
+BUSY_MESSAGE = "🚦 Сейчас слишком много запросов. Попробуйте через минуту"
+DEGRADED_MESSAGE = "⚠️ Сервис синтеза MiniMax сейчас работает с перебоями. Попробуйте через несколько минут"
+VOICE_MISSING_MESSAGE = "❌ Ваш голос больше недоступен в MiniMax. Отправьте голосовой образец заново"
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if x}
+
+# Параметры генерации по кнопкам выбора стиля
+STYLE_PARAMS = {
+    'style_neutral': {'emotion': 'neutral', 'speed': 1.0},
+    'style_happy': {'emotion': 'happy', 'speed': 1.1},
+    'style_sad': {'emotion': 'sad', 'speed': 0.9},
+    'style_angry': {'emotion': 'angry', 'speed': 1.2},
+    'style_none': {'emotion': 'neutral', 'speed': 1.0},
+    'speed_fast': {'emotion': 'neutral', 'speed': 1.5}
+}
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-user_sessions: Dict[int, Dict] = {}
+def is_admin(user_id: int) -> bool:
+    """Проверка прав администратора (ADMIN_IDS в .env)"""
+    return user_id in ADMIN_IDS
+
+def is_cancel(update: object) -> bool:
+    """/cancel обрабатывается вне очереди пользователя, чтобы прервать долгую генерацию"""
+    return isinstance(update, Update) and bool(update.message) and (update.message.text or '').startswith('/cancel')
 
 class VoiceCloneBot:
     def __init__(self):
@@ -34,13 +89,51 @@ class VoiceCloneBot:
             'start': self.handle_start,
             'waiting_voice_sample': self.handle_voice_sample,
             'waiting_text': self.handle_user_text,
-            'generating': self.handle_generation
+            'generating': self.handle_user_text,
+            'waiting_batch': self.handle_user_text
         }
+        # В режиме webhook лимиты Minimax и дисковый кэш делятся между процессами
+        self.minimax = MiniMaxClient(api_key=MINIMAX_API_KEY, max_inflight=worker_share(MINIMAX_MAX_INFLIGHT))
+        self.audio_cache = AudioCache(
+            cache_dir=worker_dir(AUDIO_CACHE_DIR), disk_bytes=worker_share(AUDIO_CACHE_DISK_BYTES)
+        )
+        self.voice_registry = VoiceRegistry()
+        self.sessions = create_session_store()
+        self.scheduler = JobScheduler(concurrency=worker_share(SCHEDULER_CONCURRENCY))
+        self.speculator = Speculator(self.scheduler)
+        self.metrics_server = MetricsServer()
+        # Пользователи, чей пакет сейчас озвучивается
+        self.batches = set()
+        # Отчеты о блокировках называют методы этого класса
+        self.loop_monitor = LoopMonitor(type(self).__name__)
+        self.profiler: Optional[SamplingProfiler] = None
+        
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        JOBS_RUNNING.set_function(lambda: self.scheduler.running)
+        JOBS_QUEUED.set_function(lambda: self.scheduler.queued)
+        MINIMAX_CIRCUIT_OPEN.set_function(lambda: int(self.minimax.breaker.is_open))
+    
+    async def startup(self, application: Application):
+        """Запуск вспомогательных сервисов вместе с приложением"""
+        await self.metrics_server.start()
+        if LOOP_MONITOR_ENABLED:
+            self.loop_monitor.start()
+    
+    async def shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке приложения"""
+        self.loop_monitor.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+        await self.metrics_server.stop()
+        await self.scheduler.close()
+        await self.minimax.close()
+        self.voice_registry.close()
+        await self.sessions.close()
     
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало работы - просим отправить голосовой образец"""
         user_id = update.effective_user.id
-        user_sessions[user_id] = {'step': 'waiting_voice_sample'}
+        await self.sessions.save(user_id, Session(step='waiting_voice_sample'))
         
         instruction = (
             "🎤 *Шаг 1/2: Отправьте голосовой образец*\n\n"
@@ -62,39 +155,80 @@ class VoiceCloneBot:
         try:
             # Получаем файл
             if update.message.voice:
-                file = await update.message.voice.get_file()
+                media = update.message.voice
                 file_ext = 'ogg'
             elif update.message.audio:
-                file = await update.message.audio.get_file()
+                media = update.message.audio
                 file_ext = update.message.audio.file_name.split('.')[-1].lower()
             else:
                 await update.message.reply_text("❌ Пожалуйста, отправьте голосовое сообщение или аудиофайл")
                 return
             
-            # Скачиваем во временный файл
-            with tempfile.NamedTemporaryFile(suffix=f'.{file_ext}', delete=False) as tmp:
-                await file.download_to_drive(tmp.name)
-                audio_path = tmp.name
+            # Тот же файл уже клонировался - используем готовый голос без скачивания
+            voice_id = await self.voice_registry.find_by_file(media.file_unique_id)
             
-            # Отправляем в Minimax для клонирования голоса
-            await update.message.reply_text("🔄 Обрабатываю голосовой образец...")
-            
-            # 1. Создаем голосовой профиль
-            voice_id = await self.create_voice_profile(audio_path, user_id)
+            if voice_id is None:
+                file = await media.get_file()
+                
+                # Скачиваем в память (крупные образцы уходят на диск сами)
+                with media_buffer() as sample:
+                    with STAGE_SECONDS.time('telegram_download'):
+                        await file.download_to_memory(sample)
+                    PAYLOAD_BYTES.inc('telegram_download', amount=sample.tell())
+                    
+                    # Отправляем в Minimax для клонирования голоса
+                    await update.message.reply_text("🔄 Обрабатываю голосовой образец...")
+                    
+                    # Совпадающий по содержимому образец тоже не клонируем повторно
+                    fingerprint = await asyncio.to_thread(buffer_fingerprint, sample)
+                    voice_id = await self.voice_registry.find_by_fingerprint(fingerprint)
+                    
+                    if voice_id is None:
+                        # Minimax недоступен - не ставим задание в очередь
+                        if self.minimax.breaker.rejecting:
+                            await update.message.reply_text(DEGRADED_MESSAGE)
+                            return
+                        
+                        # Клонирование идет через общую очередь заданий
+                        clone_key = f"clone:{user_id}:{fingerprint}"
+                        try:
+                            ticket = self.scheduler.submit(
+                                user_id, clone_key, lambda: self.clone_sample(sample, file_ext, user_id)
+                            )
+                        except QueueFull:
+                            await update.message.reply_text(BUSY_MESSAGE)
+                            return
+                        
+                        position = self.scheduler.position(ticket)
+                        if position:
+                            await update.message.reply_text(f"⏳ Вы в очереди: {position}")
+                        
+                        try:
+                            # Пока задание в очереди, слот обработчика нужен другим пользователям
+                            async with released_slot():
+                                voice_id = await self.scheduler.wait(ticket)
+                        except SampleRejected as e:
+                            await update.message.reply_text(str(e))
+                            return
+                        except CircuitOpen:
+                            await update.message.reply_text(DEGRADED_MESSAGE)
+                            return
+                        except JobCancelled:
+                            return
+                        
+                        if voice_id:
+                            await self.voice_registry.register(fingerprint, media.file_unique_id, user_id, voice_id)
             
             if voice_id:
-                user_sessions[user_id] = {
-                    'step': 'waiting_text',
-                    'voice_id': voice_id,
-                    'audio_sample_path': audio_path
-                }
+                await self.sessions.save(user_id, Session(step='waiting_text', voice_id=voice_id))
                 
                 await update.message.reply_text(
                     "✅ Голосовой образец успешно обработан!\n\n"
                     "📝 *Шаг 2/2: Введите текст для генерации*\n\n"
                     "Теперь введите текст, который вы хотите преобразовать в голос "
                     "с использованием вашего голосового образца.\n\n"
-                    "Максимальная длина: 1000 символов",
+                    f"Максимальная длина: {MAX_TEXT_LENGTH} символов. "
+                    "Длинный текст Telegram разделит на несколько сообщений - они будут объединены",
                     parse_mode='Markdown'
                 )
             else:
@@ -103,36 +237,26 @@ class VoiceCloneBot:
                     "Попробуйте другой образец или обратитесь в поддержку."
                 )
             
-            # Очистка временного файла
-            os.unlink(audio_path)
-            
         except Exception as e:
             logger.error(f"Error processing voice sample: {e}")
             await update.message.reply_text("❌ Ошибка при обработке голосового образца")
     
-    async def create_voice_profile(self, audio_path: str, user_id: int) -> Optional[str]:
+    async def clone_sample(self, sample: BinaryIO, file_ext: str, user_id: int) -> Optional[str]:
+        """Подготовка образца (моно, нужная частота, без тишины, 5-30 секунд) и клонирование"""
+        with STAGE_SECONDS.time('preprocess'):
+            prepared = await prepare_sample(sample)
+        if prepared is not None:
+            return await self.create_voice_profile(io.BytesIO(prepared), 'mp3', user_id)
+        return await self.create_voice_profile(sample, file_ext, user_id)
+    
+    async def create_voice_profile(self, sample: BinaryIO, file_ext: str, user_id: int) -> Optional[str]:
         """Создание голосового профиля в Minimax"""
         try:
-            # Читаем аудио файл в base64
-            with open(audio_path, 'rb') as audio_file:
-                audio_bytes = audio_file.read()
-                audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+            # Кодируем образец в base64 по блокам
+            audio_base64 = await asyncio.to_thread(b64encode_buffer, sample)
             
             # Определяем MIME type по расширению
-            ext = audio_path.split('.')[-1].lower()
-            mime_types = {
-                'mp3': 'audio/mpeg',
-                'wav': 'audio/wav',
-                'ogg': 'audio/ogg',
-                'm4a': 'audio/mp4'
-            }
-            mime_type = mime_types.get(ext, 'audio/mpeg')
-            
-            # Создаем запрос для клонирования голоса
-            headers = {
-                "Authorization": f"Bearer {MINIMAX_API_KEY}",
-                "Content-Type": "application/json"
-            }
+            mime_type = MIME_TYPES.get(file_ext, 'audio/mpeg')
             
             # Проверьте точную структуру запроса в документации Minimax
             payload = {
@@ -145,30 +269,35 @@ class VoiceCloneBot:
                 "gender": "auto"     # Автоопределение пола
             }
             
-            response = requests.post(
-                MINIMAX_VOICE_CLONE_API,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            PAYLOAD_BYTES.inc('minimax_clone_upload', amount=len(audio_base64))
+            with STAGE_SECONDS.time('minimax_clone'):
+                # Повтор клонирования после отправки может создать и оплатить второй голос
+                response = await self.minimax.post_json(MINIMAX_VOICE_CLONE_API, payload, idempotent=False)
             
-            if response.status_code == 200:
+            if response.status == 200:
                 data = response.json()
                 # Предполагаемая структура ответа - уточните в документации
                 return data.get("voice_id") or data.get("id") or f"user_{user_id}_voice"
             else:
-                logger.error(f"Voice clone API error: {response.status_code} - {response.text}")
+                API_ERRORS.inc('voice_clone', str(response.status))
+                logger.error(f"Voice clone API error: {response.status} - {response.text}")
                 return None
                 
+        except CircuitOpen:
+            # Пользователю нужно особое сообщение - передаем выше
+            API_ERRORS.inc('voice_clone', 'CircuitOpen')
+            raise
         except Exception as e:
+            API_ERRORS.inc('voice_clone', type(e).__name__)
             logger.error(f"Error creating voice profile: {e}")
             return None
     
     async def handle_user_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка текста от пользователя"""
         user_id = update.effective_user.id
+        session = await self.sessions.get(user_id)
         
-        if user_id not in user_sessions or 'voice_id' not in user_sessions[user_id]:
+        if session is None or not session.voice_id:
             await update.message.reply_text("❌ Сначала отправьте голосовой образец")
             await self.handle_start(update, context)
             return
@@ -179,12 +308,23 @@ class VoiceCloneBot:
             await update.message.reply_text("❌ Пожалуйста, введите текст")
             return
         
-        if len(text) > 1000:
-            await update.message.reply_text("❌ Текст слишком длинный (максимум 1000 символов)")
+        # Продолжение длинного текста, который Telegram разбил на несколько сообщений
+        sent_at = update.message.date.timestamp()
+        joined = (
+            session.step == 'generating' and bool(session.text) and session.text_at is not None
+            and len(session.text) >= TEXT_JOIN_MIN_CHARS and sent_at - session.text_at <= TEXT_JOIN_WINDOW
+        )
+        if joined:
+            text = f"{session.text}\n{text}"
+        
+        if len(text) > MAX_TEXT_LENGTH:
+            await update.message.reply_text(f"❌ Текст слишком длинный (максимум {MAX_TEXT_LENGTH} символов)")
             return
         
-        user_sessions[user_id]['text'] = text
-        user_sessions[user_id]['step'] = 'generating'
+        session.text = text
+        session.text_at = sent_at
+        session.step = 'generating'
+        await self.sessions.save(user_id, session)
         
         # Показываем кнопки для выбора эмоции/тона
         keyboard = [
@@ -204,12 +344,35 @@ class VoiceCloneBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
+        header = f"📝 Текст дополнен: {len(text)} символов" if joined else f"📝 Текст получен: *{text[:100]}...*"
         await update.message.reply_text(
-            f"📝 Текст получен: *{text[:100]}...*\n\n"
+            f"{header}\n\n"
             "Выберите стиль или параметры генерации:",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+        
+        # Пока пользователь выбирает, начинаем синтез самого вероятного стиля
+        await self.speculate(user_id, session)
+    
+    async def speculate(self, user_id: int, session: Session):
+        """Предварительный синтез последнего выбранного стиля (или обычного)"""
+        if not self.speculator.enabled or self.minimax.breaker.rejecting:
+            return
+        
+        params = STYLE_PARAMS.get(session.last_style, STYLE_PARAMS['style_neutral'])
+        text = session.text
+        voice_id = session.voice_id
+        cache_key = make_cache_key(text, voice_id, params['emotion'], params['speed'])
+        
+        # Готовое аудио уже есть в Telegram - синтезировать нечего
+        if await self.audio_cache.has_file_ids(cache_key):
+            self.speculator.drop(user_id)
+            return
+        
+        self.speculator.start(
+            user_id, cache_key, lambda: self.synthesize_text(text, voice_id, params['emotion'], params['speed'])
+        )
     
     async def handle_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка inline кнопок"""
@@ -217,81 +380,174 @@ class VoiceCloneBot:
         await query.answer()
         
         user_id = query.from_user.id
+        session = await self.sessions.get(user_id)
         
-        if user_id not in user_sessions or 'text' not in user_sessions[user_id]:
+        if session is None or not session.text or not session.voice_id:
             await query.edit_message_text("❌ Сессия устарела. Начните заново с /start")
             return
         
         # Определяем параметры генерации
-        style_map = {
-            'style_neutral': {'emotion': 'neutral', 'speed': 1.0},
-            'style_happy': {'emotion': 'happy', 'speed': 1.1},
-            'style_sad': {'emotion': 'sad', 'speed': 0.9},
-            'style_angry': {'emotion': 'angry', 'speed': 1.2},
-            'style_none': {'emotion': 'neutral', 'speed': 1.0},
-            'speed_fast': {'emotion': 'neutral', 'speed': 1.5}
-        }
-        
-        params = style_map.get(query.data, {'emotion': 'neutral', 'speed': 1.0})
+        params = STYLE_PARAMS.get(query.data, STYLE_PARAMS['style_neutral'])
+        session.last_style = query.data
         
         await query.edit_message_text("🔄 Генерирую голосовое сообщение...")
         
+        text = session.text
+        voice_id = session.voice_id
+        cache_key = make_cache_key(text, voice_id, params['emotion'], params['speed'])
+        caption = "🔊 Ваш текст, озвученный вашим голосом"
+        
+        # Синтез этого стиля мог начаться заранее; догадка о другом стиле отменяется
+        speculative = self.speculator.take(user_id, cache_key)
+        
         # Генерация голоса
         try:
-            audio_data = await self.generate_cloned_voice(
-                user_sessions[user_id]['text'],
-                user_sessions[user_id]['voice_id'],
-                params['emotion'],
-                params['speed']
-            )
+            sent = False
             
-            if audio_data:
-                # Сохраняем во временный файл
-                with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp:
-                    tmp.write(audio_data)
-                    tmp_path = tmp.name
-                
-                # Отправляем голосовое
-                with open(tmp_path, 'rb') as audio_file:
-                    await query.message.reply_voice(
-                        voice=audio_file,
-                        caption=f"🔊 Ваш текст, озвученный вашим голосом"
+            # Уже загруженное в Telegram аудио отправляем повторно по file_id
+            file_ids = await self.audio_cache.get_file_ids(cache_key) if speculative is None else None
+            if file_ids:
+                try:
+                    for index, file_id in enumerate(file_ids):
+                        with STAGE_SECONDS.time('telegram_resend'):
+                            await query.message.reply_voice(
+                                voice=file_id,
+                                caption=self._part_caption(caption, index, len(file_ids))
+                            )
+                    sent = True
+                except BadRequest as e:
+                    logger.warning(f"Cached file_id rejected: {e}")
+                    await self.audio_cache.forget_file_ids(cache_key)
+            
+            if not sent and speculative is not None:
+                ticket = speculative
+            elif not sent:
+                if self.minimax.breaker.rejecting:
+                    await query.edit_message_text(DEGRADED_MESSAGE)
+                    return
+                try:
+                    ticket = self.scheduler.submit(
+                        user_id,
+                        cache_key,
+                        lambda: self.synthesize_text(text, voice_id, params['emotion'], params['speed'])
                     )
+                except QueueFull:
+                    await query.edit_message_text(BUSY_MESSAGE)
+                    return
                 
-                # Предлагаем новые действия
-                keyboard = [
-                    [
-                        InlineKeyboardButton("📝 Новый текст", callback_data='new_text'),
-                        InlineKeyboardButton("🔄 Новый образец", callback_data='new_sample')
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                position = self.scheduler.position(ticket)
+                if position:
+                    await query.edit_message_text(
+                        f"⏳ Ваш запрос в очереди: {position}. Генерация начнется автоматически"
+                    )
+            
+            if not sent:
+                try:
+                    async with released_slot():
+                        messages = await self.scheduler.wait(ticket)
+                except CircuitOpen:
+                    await query.message.reply_text(DEGRADED_MESSAGE)
+                    return
+                except VoiceMissing:
+                    await self.reset_voice(user_id, voice_id)
+                    await query.message.reply_text(VOICE_MISSING_MESSAGE)
+                    return
+                except JobCancelled:
+                    return
                 
-                await query.message.reply_text(
-                    "✅ Готово! Что хотите сделать дальше?",
-                    reply_markup=reply_markup
-                )
+                if not messages:
+                    await query.message.reply_text("❌ Ошибка генерации голоса")
+                    return
                 
-                # Обновляем сессию
-                user_sessions[user_id]['step'] = 'waiting_text'
+                # Отправляем голосовые прямо из памяти
+                sent_ids = []
+                for index, audio_data in enumerate(messages):
+                    with STAGE_SECONDS.time('telegram_upload'):
+                        message = await query.message.reply_voice(
+                            voice=audio_data,
+                            caption=self._part_caption(caption, index, len(messages))
+                        )
+                    PAYLOAD_BYTES.inc('telegram_upload', amount=len(audio_data))
+                    if message.voice:
+                        sent_ids.append(message.voice.file_id)
                 
-                # Очистка
-                os.unlink(tmp_path)
-            else:
-                await query.message.reply_text("❌ Ошибка генерации голоса")
+                if len(sent_ids) == len(messages):
+                    await self.audio_cache.set_file_ids(cache_key, sent_ids)
+            
+            # Предлагаем новые действия
+            keyboard = [
+                [
+                    InlineKeyboardButton("📝 Новый текст", callback_data='new_text'),
+                    InlineKeyboardButton("🔄 Новый образец", callback_data='new_sample')
+                ]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await query.message.reply_text(
+                "✅ Готово! Что хотите сделать дальше?",
+                reply_markup=reply_markup
+            )
+            
+            # Обновляем сессию
+            session.step = 'waiting_text'
+            await self.sessions.save(user_id, session)
                 
         except Exception as e:
             logger.error(f"Error generating voice: {e}")
             await query.message.reply_text("❌ Ошибка при генерации голоса")
     
+    async def reset_voice(self, user_id: int, voice_id: str):
+        """Голос удален в Minimax: сессия ждет новый образец (если голос еще не сменился)"""
+        session = await self.sessions.get(user_id)
+        if session is None or session.voice_id == voice_id:
+            await self.sessions.save(user_id, Session(step='waiting_voice_sample'))
+    
+    @staticmethod
+    def _part_caption(caption: str, index: int, total: int) -> str:
+        return caption if total == 1 else f"{caption} ({index + 1}/{total})"
+    
+    async def synthesize_text(self, text: str, voice_id: str, emotion: str, speed: float) -> Optional[List[bytes]]:
+        """Синтез текста в голосовые сообщения OGG/Opus"""
+        stitched = await self.synthesize_stitched(text, voice_id, emotion, speed, 'opus' if OPUS_ENABLED else 'mp3')
+        if not stitched:
+            return None
+        
+        messages, audio_format = stitched
+        if audio_format == 'opus' or not OPUS_ENABLED:
+            # Склеенные куски сразу закодированы в Opus - без второго сжатия с потерями
+            return messages
+        
+        # Telegram ожидает голосовые сообщения в OGG/Opus
+        with STAGE_SECONDS.time('transcode'):
+            return list(await asyncio.gather(*(to_ogg_opus(message) for message in messages)))
+    
+    async def synthesize_audio(self, text: str, voice_id: str, emotion: str, speed: float) -> Optional[List[bytes]]:
+        """Синтез текста любой длины в MP3"""
+        stitched = await self.synthesize_stitched(text, voice_id, emotion, speed, 'mp3')
+        return stitched[0] if stitched else None
+    
+    async def synthesize_stitched(self, text: str, voice_id: str, emotion: str, speed: float,
+                                  output_format: str) -> Optional[Tuple[List[bytes], str]]:
+        """Разбиение на куски, параллельный TTS и склейка; возвращает сообщения и их формат"""
+        async def synthesize_chunk(chunk: str) -> Optional[bytes]:
+            chunk_key = make_cache_key(chunk, voice_id, emotion, speed)
+            audio_data = await self.audio_cache.get(chunk_key)
+            if audio_data is None:
+                audio_data = await self.generate_cloned_voice(chunk, voice_id, emotion, speed)
+                if audio_data:
+                    await self.audio_cache.put(chunk_key, audio_data)
+            return audio_data
+        
+        chunks = split_text(text)
+        parts = await synthesize_chunks(chunks, synthesize_chunk)
+        if not parts:
+            return None
+        with STAGE_SECONDS.time('stitch'):
+            return await asyncio.to_thread(stitch_audio, parts, output_format=output_format)
+    
     async def generate_cloned_voice(self, text: str, voice_id: str, emotion: str = "neutral", speed: float = 1.0) -> Optional[bytes]:
         """Генерация голоса с клонированным голосом"""
         try:
-            headers = {
-                "Authorization": f"Bearer {MINIMAX_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
             # Формируем запрос для TTS с клонированным голосом
             # Уточните точную структуру в документации Minimax
             payload = {
@@ -308,32 +564,49 @@ class VoiceCloneBot:
                 "pitch": 1.0
             }
             
-            response = requests.post(
-                MINIMAX_TTS_API,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            with STAGE_SECONDS.time('minimax_tts'):
+                # Синтез идемпотентен - медленный ответ можно продублировать
+                response = await self.minimax.post_json(MINIMAX_TTS_API, payload, hedge=True)
+            PAYLOAD_BYTES.inc('minimax_tts_download', amount=len(response.body))
+            
+            # Голос удален в Minimax - не выдаем его из реестра повторно
+            if response.base_code in MINIMAX_VOICE_MISSING_CODES:
+                API_ERRORS.inc('tts', 'voice_missing')
+                await self.voice_registry.forget(voice_id)
+                logger.warning(f"Voice {voice_id} no longer exists in MiniMax, removed from registry")
+                raise VoiceMissing()
             
-            if response.status_code == 200:
+            if response.status == 200:
                 # Проверьте формат ответа - может быть base64 или бинарные данные
-                if 'application/json' in response.headers.get('Content-Type', ''):
+                if 'application/json' in response.content_type:
                     data = response.json()
                     # Если аудио в base64
                     if 'audio_data' in data:
                         return base64.b64decode(data['audio_data'])
                     # Если есть URL до аудио
                     elif 'audio_url' in data:
-                        audio_response = requests.get(data['audio_url'])
-                        return audio_response.content
+                        with STAGE_SECONDS.time('minimax_tts_audio_url'):
+                            status, audio_content = await self.minimax.get_bytes(data['audio_url'])
+                        if status != 200:
+                            API_ERRORS.inc('tts_audio_url', str(status))
+                            logger.error(f"TTS audio download error: {status}")
+                            return None
+                        return audio_content
                 else:
                     # Бинарные данные
-                    return response.content
+                    return response.body
             else:
-                logger.error(f"TTS API error: {response.status_code} - {response.text}")
+                API_ERRORS.inc('tts', str(response.status))
+                logger.error(f"TTS API error: {response.status} - {response.text}")
                 return None
                 
+        except CircuitOpen:
+            API_ERRORS.inc('tts', 'CircuitOpen')
+            raise
+        except VoiceMissing:
+            raise
         except Exception as e:
+            API_ERRORS.inc('tts', type(e).__name__)
             logger.error(f"Error in TTS generation: {e}")
             return None
     
@@ -343,12 +616,15 @@ class VoiceCloneBot:
         await query.answer()
         
         user_id = query.from_user.id
+        session = await self.sessions.get(user_id)
         
-        if user_id in user_sessions and 'voice_id' in user_sessions[user_id]:
-            user_sessions[user_id]['step'] = 'waiting_text'
+        if session is not None and session.voice_id:
+            session.step = 'waiting_text'
+            await self.sessions.save(user_id, session)
             await query.edit_message_text(
                 "📝 Введите новый текст для генерации голосом:\n\n"
-                "Максимальная длина: 1000 символов"
+                f"Максимальная длина: {MAX_TEXT_LENGTH} символов. "
+                "Длинный текст Telegram разделит на несколько сообщений - они будут объединены"
             )
         else:
             await query.edit_message_text("❌ Голосовой профиль не найден. Начните заново с /start")
@@ -359,7 +635,7 @@ class VoiceCloneBot:
         await query.answer()
         
         user_id = query.from_user.id
-        user_sessions[user_id] = {'step': 'waiting_voice_sample'}
+        await self.sessions.save(user_id, Session(step='waiting_voice_sample'))
         
         await query.edit_message_text(
             "🎤 Отправьте новый голосовой образец:\n\n"
@@ -371,8 +647,17 @@ class VoiceCloneBot:
         """Основной обработчик сообщений"""
         user_id = update.effective_user.id
         
+        session = await self.sessions.get(user_id)
+        
+        # Вернувшийся пользователь (например, после перезапуска) продолжает со своим голосом
+        if session is None and update.message.text:
+            voice_id = await self.voice_registry.find_by_user(user_id)
+            if voice_id:
+                session = Session(step='waiting_text', voice_id=voice_id)
+                await self.sessions.save(user_id, session)
+        
         # Определяем текущий шаг пользователя
-        current_step = user_sessions.get(user_id, {}).get('step', 'start')
+        current_step = session.step if session is not None else 'start'
         
         # Вызываем соответствующий обработчик
         handler = self.steps.get(current_step)
@@ -381,6 +666,215 @@ class VoiceCloneBot:
         else:
             await self.handle_start(update, context)
     
+    async def batch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пакетная озвучка: ждем файл со списком фраз"""
+        user_id = update.effective_user.id
+        session = await self.sessions.get(user_id)
+        
+        if session is None or not session.voice_id:
+            voice_id = await self.voice_registry.find_by_user(user_id)
+            if not voice_id:
+                await update.message.reply_text("❌ Сначала отправьте голосовой образец. Начните с /start")
+                return
+            session = Session(voice_id=voice_id)
+        
+        session.step = 'waiting_batch'
+        await self.sessions.save(user_id, session)
+        
+        await update.message.reply_text(
+            "📄 *Пакетная озвучка*\n\n"
+            "Отправьте файл .txt (одна фраза на строку) или .csv с колонками "
+            "text и style (необязательно).\n\n"
+            "Стили: neutral, happy, sad, angry, none, fast\n"
+            f"Максимум строк: {BATCH_MAX_LINES}",
+            parse_mode='Markdown'
+        )
+    
+    @staticmethod
+    def _batch_style(style: Optional[str]) -> Optional[dict]:
+        if not style:
+            return STYLE_PARAMS['style_neutral']
+        for name in (style, f"style_{style}", f"speed_{style}"):
+            if name in STYLE_PARAMS:
+                return STYLE_PARAMS[name]
+        return None
+    
+    async def handle_batch_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Прием файла для пакетной озвучки"""
+        user_id = update.effective_user.id
+        session = await self.sessions.get(user_id)
+        
+        if session is None or session.step != 'waiting_batch' or not session.voice_id:
+            await update.message.reply_text("📄 Чтобы озвучить файл со списком фраз, отправьте команду /batch")
+            return
+        if user_id in self.batches:
+            await update.message.reply_text("⏳ Предыдущий пакет еще озвучивается")
+            return
+        
+        document = update.message.document
+        file_ext = (document.file_name or '').rsplit('.', 1)[-1].lower()
+        if file_ext not in BATCH_EXTENSIONS:
+            await update.message.reply_text("❌ Поддерживаются файлы .txt и .csv")
+            return
+        if document.file_size and document.file_size > BATCH_MAX_FILE_BYTES:
+            await update.message.reply_text(
+                f"❌ Файл слишком большой (максимум {BATCH_MAX_FILE_BYTES // 1024} КБ)"
+            )
+            return
+        
+        try:
+            file = await document.get_file()
+            with media_buffer() as buffer:
+                await file.download_to_memory(buffer)
+                lines = await asyncio.to_thread(parse_batch, buffer, file_ext)
+            
+            items = []
+            for number, (text, style) in enumerate(lines, 1):
+                params = self._batch_style(style)
+                if params is None:
+                    raise BatchRejected(f"❌ Неизвестный стиль в строке {number}: {style}")
+                items.append((text, style or 'neutral', params))
+        except BatchRejected as e:
+            await update.message.reply_text(str(e))
+            return
+        except Exception as e:
+            logger.error(f"Error reading batch file: {e}")
+            await update.message.reply_text("❌ Ошибка при чтении файла")
+            return
+        
+        session.step = 'waiting_text'
+        await self.sessions.save(user_id, session)
+        
+        status = await update.message.reply_text(f"📄 Принято строк: {len(items)}. Начинаю озвучку...")
+        
+        # Озвучка идет в фоне, чтобы не задерживать обработку других обновлений
+        self.batches.add(user_id)
+        context.application.create_task(
+            self.run_batch(user_id, session.voice_id, items, status), update=update
+        )
+    
+    async def run_batch(self, user_id: int, voice_id: str, items: list, status):
+        """Озвучка пакета: строки идут через общую очередь заданий, клипы сразу пишутся в архив"""
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        width = len(str(len(items)))
+        
+        async def synthesize_line(index: int, text: str, params: dict):
+            # Ключ отличается от голосовых сообщений: здесь результат в MP3, а не OGG
+            key = "mp3:" + make_cache_key(text, voice_id, params['emotion'], params['speed'])
+            async with semaphore:
+                try:
+                    ticket = self.scheduler.submit(
+                        user_id, key, lambda: self.synthesize_audio(text, voice_id, params['emotion'], params['speed'])
+                    )
+                except QueueFull:
+                    return index, None
+                return index, await self.scheduler.wait(ticket)
+        
+        tasks = [
+            asyncio.create_task(synthesize_line(index, text, params))
+            for index, (text, _, params) in enumerate(items)
+        ]
+        archive = BatchArchive()
+        part = 1
+        done = 0
+        voiced = set()
+        degraded = False
+        voice_missing = False
+        last_progress = time.monotonic()
+        
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    index, messages = await future
+                except CircuitOpen:
+                    # Minimax недоступен - отдаем то, что успели озвучить
+                    degraded = True
+                    break
+                except VoiceMissing:
+                    voice_missing = True
+                    break
+                done += 1
+                name = f"{index + 1:0{width}d}"
+                if messages:
+                    for number, audio in enumerate(messages, 1):
+                        suffix = '' if len(messages) == 1 else f"_{number}"
+                        await asyncio.to_thread(archive.add, f"{name}{suffix}.mp3", audio)
+                    voiced.add(index + 1)
+                
+                if archive.size >= BATCH_MAX_ZIP_BYTES:
+                    await self._send_archive(status, archive, f"voices_{part}.zip")
+                    archive.close()
+                    archive = BatchArchive()
+                    part += 1
+                
+                if time.monotonic() - last_progress >= BATCH_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    try:
+                        await status.edit_text(f"⏳ Озвучено {done} из {len(items)}")
+                    except BadRequest:
+                        pass
+            
+            # Оглавление: какой файл какой строке соответствует
+            manifest = io.StringIO()
+            writer = csv.writer(manifest)
+            writer.writerow(['file', 'style', 'status', 'text'])
+            for index, (text, style, _) in enumerate(items, 1):
+                ok = index in voiced
+                writer.writerow([f"{index:0{width}d}.mp3" if ok else '', style, 'ok' if ok else 'error', text])
+            archive.add_text('lines.csv', manifest.getvalue())
+            
+            if voiced:
+                await self._send_archive(status, archive, "voices.zip" if part == 1 else f"voices_{part}.zip")
+            
+            result = f"✅ Готово: озвучено {len(voiced)} из {len(items)}"
+            if degraded:
+                result = f"{DEGRADED_MESSAGE}\n\nОзвучено {len(voiced)} из {len(items)}"
+            elif voice_missing:
+                await self.reset_voice(user_id, voice_id)
+                result = f"{VOICE_MISSING_MESSAGE}\n\nОзвучено {len(voiced)} из {len(items)}"
+            failed = [number for number in range(1, len(items) + 1) if number not in voiced]
+            if failed:
+                shown = ', '.join(str(number) for number in failed[:20])
+                result += f"\n\n❌ Не удалось озвучить строки: {shown}" + (' ...' if len(failed) > 20 else '')
+            await status.edit_text(result)
+        
+        except JobCancelled:
+            await status.edit_text("⏹ Пакетная озвучка отменена")
+        except Exception as e:
+            logger.error(f"Error in batch synthesis: {e}")
+            await status.reply_text("❌ Ошибка при пакетной озвучке")
+        finally:
+            for task in tasks:
+                task.cancel()
+            archive.close()
+            self.batches.discard(user_id)
+    
+    async def _send_archive(self, status, archive: BatchArchive, filename: str):
+        buffer = await asyncio.to_thread(archive.finish)
+        # Клиент Bot API все равно читает файл целиком перед отправкой
+        data = await asyncio.to_thread(buffer.read)
+        PAYLOAD_BYTES.inc('telegram_batch_upload', amount=len(data))
+        with STAGE_SECONDS.time('telegram_batch_upload'):
+            await status.reply_document(
+                document=data,
+                filename=filename,
+                caption=f"🔊 Озвучено файлов: {archive.entries}"
+            )
+    
+    async def count_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Счетчик входящих обновлений по типу"""
+        if update.callback_query:
+            kind = 'callback_query'
+        elif update.message and (update.message.voice or update.message.audio):
+            kind = 'voice'
+        elif update.message and update.message.document:
+            kind = 'document'
+        elif update.message:
+            kind = 'command' if (update.message.text or '').startswith('/') else 'message'
+        else:
+            kind = 'other'
+        UPDATES.inc(kind)
+    
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда помощи"""
         help_text = (
@@ -393,7 +887,8 @@ class VoiceCloneBot:
             "*Команды:*\n"
             "/start - Начать заново\n"
             "/help - Эта справка\n"
-            "/cancel - Отменить текущую операцию\n\n"
+            "/cancel - Отменить текущую операцию\n"
+            "/batch - Озвучить список фраз из файла .txt или .csv\n\n"
             "*Требования к образцу:*\n"
             "• 5-30 секунд чистой речи\n"
             "• Один говорящий\n"
@@ -405,20 +900,121 @@ class VoiceCloneBot:
     async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отмена текущей операции"""
         user_id = update.effective_user.id
-        if user_id in user_sessions:
-            del user_sessions[user_id]
+        self.speculator.drop(user_id)
+        self.scheduler.cancel_user(user_id)
+        await self.sessions.delete(user_id)
         await update.message.reply_text("✅ Текущая операция отменена. Начните заново с /start")
-
-def main():
-    """Запуск бота"""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
     
+    async def cache_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Статистика кэша аудио (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            return
+        stats = self.audio_cache.stats()
+        lines = [f"{name}: {value}" for name, value in stats.items()]
+        await update.message.reply_text("📊 Кэш аудио\n\n" + "\n".join(lines))
+    
+    async def purge_voices_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Очистка реестра голосов: /purge_voices <user_id|all> (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            return
+        
+        args = context.args or []
+        if len(args) != 1 or not (args[0] == 'all' or args[0].isdigit()):
+            count = await self.voice_registry.count()
+            await update.message.reply_text(
+                f"Использование: /purge_voices <user_id|all>\n\nЗаписей в реестре: {count}"
+            )
+            return
+        
+        target = None if args[0] == 'all' else int(args[0])
+        if target is None:
+            # В режиме webhook команда приходит во все процессы: каждый очищает свои сессии,
+            # а реестр очищает и отвечает процесс администратора
+            await self.sessions.clear()
+            if not worker_owns(update.effective_user.id):
+                return
+        else:
+            # Маршрутизатор направил команду в процесс, где хранится сессия пользователя
+            await self.sessions.delete(target)
+        removed = await self.voice_registry.purge(target)
+        await update.message.reply_text(f"🗑 Удалено записей: {removed}")
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Профилирование цикла событий: /profile [секунды], повторный вызов останавливает
+        (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            return
+        
+        if self.profiler is not None:
+            self.profiler.stop()
+            await update.message.reply_text("⏹ Профилирование остановлено, готовлю отчет...")
+            return
+        
+        args = context.args or []
+        seconds = int(args[0]) if args and args[0].isdigit() else 30
+        seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+        
+        # Обработчик выполняется в потоке цикла событий - его и профилируем
+        self.profiler = SamplingProfiler(threading.get_ident(), type(self).__name__)
+        await update.message.reply_text(
+            f"🔬 Профилирование на {seconds} с. Отправьте /profile еще раз, чтобы остановить раньше"
+        )
+        context.application.create_task(self.run_profiler(self.profiler, seconds, update.message), update=update)
+    
+    async def run_profiler(self, profiler: SamplingProfiler, seconds: int, message):
+        """Сбор выборок в отдельном потоке и отправка свернутых стеков документом"""
+        try:
+            await asyncio.to_thread(profiler.run, seconds)
+            if not profiler.samples:
+                await message.reply_text("🔬 Профилирование завершено: нет выборок")
+                return
+            
+            idle, handlers = profiler.summary()
+            lines = [f"Выборок: {profiler.samples}", f"Простой цикла: {idle:.0%}"]
+            lines.extend(f"{name}: {count}" for name, count in handlers)
+            await message.reply_document(
+                document=profiler.collapsed().encode('utf-8'),
+                filename=f"profile-{int(time.time())}.folded",
+                caption="🔬 Свернутые стеки (flamegraph.pl, speedscope)\n\n" + "\n".join(lines)
+            )
+        except Exception as e:
+            logger.error(f"Error in profiling: {e}")
+            await message.reply_text("❌ Ошибка профилирования")
+        finally:
+            if self.profiler is profiler:
+                self.profiler = None
+
+def build_application() -> Application:
+    """Создание приложения с зарегистрированными обработчиками"""
     bot = VoiceCloneBot()
     
+    # Обновления разных пользователей обрабатываются параллельно, одного - по порядку
+    update_processor = PerUserUpdateProcessor(bypass=is_cancel)
+    UPDATES_RUNNING.set_function(lambda: update_processor.running)
+    UPDATE_USERS.set_function(lambda: update_processor.users)
+    
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(update_processor)
+        .post_init(bot.startup)
+        .post_shutdown(bot.shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+    
+    # Учет всех входящих обновлений для метрик пропускной способности
+    application.add_handler(TypeHandler(Update, bot.count_update), group=-1)
+    
     # Регистрация обработчиков
     application.add_handler(CommandHandler("start", bot.handle_start))
     application.add_handler(CommandHandler("help", bot.help_command))
     application.add_handler(CommandHandler("cancel", bot.cancel_command))
+    application.add_handler(CommandHandler("batch", bot.batch_command))
+    application.add_handler(CommandHandler("cache_stats", bot.cache_stats_command))
+    application.add_handler(CommandHandler("purge_voices", bot.purge_voices_command))
+    application.add_handler(CommandHandler("profile", bot.profile_command))
     
     # Обработчики кнопок
     application.add_handler(CallbackQueryHandler(bot.handle_button, pattern='^style_|^speed_'))
@@ -428,6 +1024,23 @@ def main():
     # Обработчики сообщений
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
     application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, bot.handle_message))
+    # Только списки фраз: аудио, отправленное файлом, сюда не попадает
+    batch_files = filters.Document.FileExtension(BATCH_EXTENSIONS[0])
+    for extension in BATCH_EXTENSIONS[1:]:
+        batch_files |= filters.Document.FileExtension(extension)
+    application.add_handler(MessageHandler(batch_files, bot.handle_batch_file))
+    
+    return application
+
+def main():
+    """Запуск бота"""
+    if BOT_MODE == 'webhook':
+        # Несколько процессов за одним webhook, пользователи распределяются по процессам
+        logger.info("Бот запущен в режиме webhook...")
+        WebhookRouter(build_application, TELEGRAM_TOKEN).run()
+        return
+    
+    application = build_application()
     
     # Запуск бота
     logger.info("Бот запущен...")
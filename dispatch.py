@@ -0,0 +1,149 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько обработчиков выполняется одновременно (обновления разных пользователей)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))
+# Сколько обновлений может ждать своей очереди, прежде чем прием новых приостановится
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+class _Slot:
+    """Занятый обработчиком слот общего лимита"""
+    __slots__ = ('processor', 'task', 'held')
+
+    def __init__(self, processor: 'PerUserUpdateProcessor', task: Optional[asyncio.Task]):
+        self.processor = processor
+        self.task = task
+        self.held = False
+
+
+_current_slot: ContextVar[Optional[_Slot]] = ContextVar('update_slot', default=None)
+
+
+@asynccontextmanager
+async def released_slot() -> AsyncIterator[None]:
+    """Обработчик ждет внешнего результата (очередь заданий): общий слот отдается
+    другим обновлениям, замок пользователя остается за ним.
+    """
+    slot = _current_slot.get()
+    # Фоновые задачи наследуют контекст обработчика, но не его слот
+    if slot is None or not slot.held or slot.task is not asyncio.current_task():
+        yield
+        return
+    slot.processor._release(slot)
+    try:
+        yield
+    finally:
+        await slot.processor._acquire(slot)
+
+
+class _UserSlot:
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+def update_key(update: object) -> Optional[int]:
+    """Ключ очереди: пользователь, а без него - чат"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей с сохранением порядка
+    для каждого пользователя.
+
+    Обновления одного пользователя выполняются строго по очереди (замок на пользователя,
+    asyncio.Lock пропускает ожидающих по порядку). Общий лимит UPDATE_CONCURRENCY
+    занимается только после получения замка, поэтому очередь одного пользователя
+    не забирает слоты у остальных, а на время released_slot() (ожидание Minimax)
+    слот возвращается. Замок удаляется, как только у пользователя
+    не остается обновлений.
+    """
+
+    __slots__ = ('concurrency', 'bypass', '_users', '_active', '_running')
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING,
+                 bypass: Optional[Callable[[object], bool]] = None):
+        super().__init__(max(max_pending, 2))
+        self.concurrency = concurrency
+        # Обновления, которые обрабатываются вне очереди пользователя (например, /cancel)
+        self.bypass = bypass
+        self._users: Dict[int, _UserSlot] = {}
+        self._active: Optional[asyncio.Semaphore] = None
+        self._running = 0
+
+    @property
+    def users(self) -> int:
+        """Пользователи, у которых есть обновления в работе или в очереди"""
+        return len(self._users)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def initialize(self) -> None:
+        self._active = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        self._users.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Вне очереди и вне общего лимита: иначе /cancel ждал бы те самые обработчики,
+        # которые должен прервать
+        if self.bypass is not None and self.bypass(update):
+            await coroutine
+            return
+
+        key = update_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        slot = self._users.get(key)
+        if slot is None:
+            slot = self._users[key] = _UserSlot()
+        slot.pending += 1
+        try:
+            async with slot.lock:
+                await self._run(coroutine)
+        finally:
+            slot.pending -= 1
+            if slot.pending == 0 and self._users.get(key) is slot:
+                del self._users[key]
+
+    async def _acquire(self, slot: _Slot):
+        await self._active.acquire()
+        slot.held = True
+        self._running += 1
+
+    def _release(self, slot: _Slot):
+        slot.held = False
+        self._running -= 1
+        self._active.release()
+
+    async def _run(self, coroutine: Awaitable[Any]):
+        slot = _Slot(self, asyncio.current_task())
+        await self._acquire(slot)
+        token = _current_slot.set(slot)
+        try:
+            await coroutine
+        finally:
+            _current_slot.reset(token)
+            if slot.held:
+                self._release(slot)
@@ -0,0 +1,44 @@
+import os
+import base64
+import hashlib
+import tempfile
+from typing import BinaryIO
+
+# Образцы больше этого размера (байт) сбрасываются из памяти во временный файл
+MEDIA_SPOOL_THRESHOLD = int(os.getenv('MEDIA_SPOOL_THRESHOLD', str(8 * 1024 * 1024)))
+
+# Размер блока для потоковой обработки; кратен 3, чтобы части base64 склеивались без паддинга
+CHUNK_SIZE = 3 * 64 * 1024
+
+MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'ogg': 'audio/ogg',
+    'm4a': 'audio/mp4'
+}
+
+
+def media_buffer(threshold: int = MEDIA_SPOOL_THRESHOLD) -> BinaryIO:
+    """Буфер в памяти, который переходит на диск только при превышении порога"""
+    return tempfile.SpooledTemporaryFile(max_size=threshold)
+
+
+def iter_chunks(buffer: BinaryIO, chunk_size: int = CHUNK_SIZE):
+    buffer.seek(0)
+    for chunk in iter(lambda: buffer.read(chunk_size), b''):
+        yield chunk
+    buffer.seek(0)
+
+
+def buffer_fingerprint(buffer: BinaryIO) -> str:
+    """sha256 содержимого буфера"""
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(buffer):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def b64encode_buffer(buffer: BinaryIO) -> str:
+    """Кодирование буфера в base64 по блокам, без промежуточной копии всех байт"""
+    return ''.join(base64.b64encode(chunk).decode('ascii') for chunk in iter_chunks(buffer))
+
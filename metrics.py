@@ -0,0 +1,186 @@
+import os
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+# 0 - отключить; в режиме webhook процесс N слушает METRICS_PORT + N
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, values)} {value}"
+            for values, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Значение читается функцией в момент запроса метрик"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._callback: Optional[Callable[[], float]] = None
+
+    def set_function(self, callback: Callable[[], float]):
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        if self._callback is None:
+            return []
+        return [f"{self.name} {self._callback()}"]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # значения: [счетчики по корзинам..., +Inf], сумма
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = _format_labels(self.labels, values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total[0]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+STAGE_SECONDS = Histogram(
+    'voicebot_stage_seconds', 'Latency of processing stages', ('stage',)
+)
+API_ERRORS = Counter(
+    'voicebot_minimax_errors_total', 'Failed MiniMax API calls by status code', ('endpoint', 'status')
+)
+PAYLOAD_BYTES = Counter(
+    'voicebot_payload_bytes_total', 'Bytes transferred by stage', ('stage',)
+)
+API_RETRIES = Counter(
+    'voicebot_minimax_retries_total', 'Retried MiniMax calls by failure reason', ('reason',)
+)
+HEDGED_REQUESTS = Counter(
+    'voicebot_minimax_hedged_total', 'Hedged TTS requests: sent and won by the duplicate', ('outcome',)
+)
+SPECULATION = Counter(
+    'voicebot_speculation_total', 'Speculative syntheses: started, skipped, over_budget, hit, miss, dropped, expired', ('outcome',)
+)
+UPDATES = Counter(
+    'voicebot_updates_total', 'Incoming Telegram updates by type', ('type',)
+)
+ACTIVE_SESSIONS = Gauge('voicebot_active_sessions', 'Sessions held in memory')
+JOBS_RUNNING = Gauge('voicebot_jobs_running', 'Generation jobs in flight')
+JOBS_QUEUED = Gauge('voicebot_jobs_queued', 'Generation jobs waiting in the queue')
+LOOP_LAG = Histogram(
+    'voicebot_loop_lag_seconds', 'Event loop wake-up delay',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LOOP_BLOCKS = Counter(
+    'voicebot_loop_blocks_total', 'Event loop blocked beyond the threshold, by handler', ('handler',)
+)
+UPDATES_RUNNING = Gauge('voicebot_updates_running', 'Updates being handled right now')
+UPDATE_USERS = Gauge('voicebot_update_users', 'Users with updates in progress or waiting in their queue')
+MINIMAX_CIRCUIT_OPEN = Gauge('voicebot_minimax_circuit_open', '1 while MiniMax calls are rejected by the breaker')
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+class MetricsServer:
+    """HTTP endpoint /metrics в формате Prometheus"""
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+        self.listen = listen
+        self.port = port + int(os.getenv('BOT_WORKER_INDEX', '0')) if port else 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Metrics on http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
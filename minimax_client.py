@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import aiohttp
+
+from metrics import API_RETRIES, HEDGED_REQUESTS
+
+MINIMAX_API_KEY = os.getenv('MINIMAX_API_KEY')
+
+# Параметры пула соединений и таймаутов (секунды)
+MINIMAX_POOL_SIZE = int(os.getenv('MINIMAX_POOL_SIZE', '100'))
+MINIMAX_POOL_PER_HOST = int(os.getenv('MINIMAX_POOL_PER_HOST', '32'))
+MINIMAX_KEEPALIVE = float(os.getenv('MINIMAX_KEEPALIVE', '30'))
+MINIMAX_CONNECT_TIMEOUT = float(os.getenv('MINIMAX_CONNECT_TIMEOUT', '5'))
+MINIMAX_READ_TIMEOUT = float(os.getenv('MINIMAX_READ_TIMEOUT', '30'))
+# Общий лимит одновременных запросов к Minimax (по квоте аккаунта)
+MINIMAX_MAX_INFLIGHT = int(os.getenv('MINIMAX_MAX_INFLIGHT', '16'))
+
+# Повторы при 429, 5xx и сетевых ошибках: экспоненциальная задержка со случайным разбросом
+MINIMAX_MAX_ATTEMPTS = int(os.getenv('MINIMAX_MAX_ATTEMPTS', '4'))
+MINIMAX_BACKOFF_BASE = float(os.getenv('MINIMAX_BACKOFF_BASE', '0.5'))
+MINIMAX_BACKOFF_MAX = float(os.getenv('MINIMAX_BACKOFF_MAX', '8'))
+# Общий бюджет времени на вызов вместе со всеми повторами
+MINIMAX_DEADLINE = float(os.getenv('MINIMAX_DEADLINE', '60'))
+# Размыкатель: после стольких сбоев подряд вызовы сразу отклоняются на время паузы
+MINIMAX_BREAKER_THRESHOLD = int(os.getenv('MINIMAX_BREAKER_THRESHOLD', '5'))
+MINIMAX_BREAKER_COOLDOWN = float(os.getenv('MINIMAX_BREAKER_COOLDOWN', '30'))
+# Дублирующий запрос TTS, если ответ задерживается дольше p95 (удваивает нагрузку на хвосте)
+MINIMAX_HEDGE_ENABLED = os.getenv('MINIMAX_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+MINIMAX_HEDGE_QUANTILE = float(os.getenv('MINIMAX_HEDGE_QUANTILE', '0.95'))
+MINIMAX_HEDGE_MIN_DELAY = float(os.getenv('MINIMAX_HEDGE_MIN_DELAY', '0.5'))
+# Коды base_resp, означающие, что voice_id в Minimax больше нет (через запятую)
+MINIMAX_VOICE_MISSING_CODES = frozenset(
+    int(code) for code in os.getenv('MINIMAX_VOICE_MISSING_CODES', '2042,20132').split(',') if code.strip()
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MiniMaxResponse:
+    """Прочитанный ответ Minimax: статус, заголовки и тело"""
+
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('Content-Type', '')
+
+    @property
+    def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+    @property
+    def base_code(self) -> Optional[int]:
+        """Код ошибки Minimax из base_resp (0 - успех), None для не-JSON ответа"""
+        if 'application/json' not in self.content_type:
+            return None
+        try:
+            data = self.json()
+        except ValueError:
+            return None
+        base_resp = data.get('base_resp') if isinstance(data, dict) else None
+        return base_resp.get('status_code') if isinstance(base_resp, dict) else None
+
+
+class CircuitOpen(Exception):
+    """Minimax недоступен: вызов отклонен без обращения к API"""
+
+
+class VoiceMissing(Exception):
+    """voice_id удален в Minimax или недоступен аккаунту"""
+
+
+def _retryable(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+# Ошибки, при которых запрос точно не дошел до Minimax (ConnectionTimeoutError - с aiohttp 3.10)
+_CONNECT_ERRORS = (aiohttp.ClientConnectorError,) + (
+    (aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, 'ConnectionTimeoutError') else ()
+)
+
+
+def _retry_after(response: MiniMaxResponse) -> Optional[float]:
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после серии сбоев вызовы отклоняются до истечения паузы,
+    затем пропускается один пробный запрос.
+    """
+
+    def __init__(self, threshold: int = MINIMAX_BREAKER_THRESHOLD, cooldown: float = MINIMAX_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    @property
+    def rejecting(self) -> bool:
+        """Цепь разомкнута и пауза еще не истекла - вызов точно будет отклонен"""
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def check(self):
+        """CircuitOpen, если запрос сейчас выполнять нельзя"""
+        if self._opened_at is None:
+            return
+        now = time.monotonic()
+        if now - self._opened_at < self.cooldown:
+            raise CircuitOpen()
+        # Пробный запрос один; зависший пробный запрос не блокирует цепь дольше паузы
+        if self._probe_at is not None and now - self._probe_at < self.cooldown:
+            raise CircuitOpen()
+        self._probe_at = now
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info("MiniMax circuit closed")
+        self.failures = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_at is not None or (self._opened_at is None and self.failures >= self.threshold):
+            if self._opened_at is None:
+                logger.warning(f"MiniMax circuit opened after {self.failures} failures")
+            self._opened_at = time.monotonic()
+            self._probe_at = None
+
+
+class LatencyTracker:
+    """Скользящее окно последних задержек для оценки квантилей"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class MiniMaxClient:
+    """Общий асинхронный HTTP клиент для Minimax с пулом keep-alive соединений,
+    повторами, размыкателем цепи и дублирующими запросами.
+    """
+
+    def __init__(self, api_key: Optional[str] = None,
+                 pool_size: int = MINIMAX_POOL_SIZE,
+                 pool_per_host: int = MINIMAX_POOL_PER_HOST,
+                 keepalive: float = MINIMAX_KEEPALIVE,
+                 connect_timeout: float = MINIMAX_CONNECT_TIMEOUT,
+                 read_timeout: float = MINIMAX_READ_TIMEOUT,
+                 max_inflight: int = MINIMAX_MAX_INFLIGHT,
+                 max_attempts: int = MINIMAX_MAX_ATTEMPTS,
+                 deadline: float = MINIMAX_DEADLINE,
+                 hedge_enabled: bool = MINIMAX_HEDGE_ENABLED):
+        self.api_key = api_key or MINIMAX_API_KEY
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.hedge_enabled = hedge_enabled
+        self.breaker = CircuitBreaker()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self.max_inflight = max_inflight
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=connect_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создается лениво, внутри работающего event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_per_host,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _get_inflight(self) -> asyncio.Semaphore:
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+        return self._inflight
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> MiniMaxResponse:
+        session = self._get_session()
+        async with self._get_inflight():
+            started = time.monotonic()
+            async with session.post(url, json=payload, headers=self.headers) as response:
+                body = await response.read()
+                result = MiniMaxResponse(response.status, dict(response.headers), body)
+        if not _retryable(result.status):
+            self._latency.setdefault(url, LatencyTracker()).observe(time.monotonic() - started)
+        return result
+
+    def _hedge_delay(self, url: str) -> Optional[float]:
+        tracker = self._latency.get(url)
+        quantile = tracker.quantile(MINIMAX_HEDGE_QUANTILE) if tracker else None
+        return max(quantile, MINIMAX_HEDGE_MIN_DELAY) if quantile is not None else None
+
+    async def _post_hedged(self, url: str, payload: Dict[str, Any]) -> MiniMaxResponse:
+        """Второй такой же запрос, если первый отвечает дольше обычного; берется первый удачный ответ"""
+        primary = asyncio.create_task(self._post(url, payload))
+        delay = self._hedge_delay(url)
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    HEDGED_REQUESTS.inc('sent')
+                    tasks.append(asyncio.create_task(self._post(url, payload)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and not _retryable(task.result().status):
+                        if task is not primary:
+                            HEDGED_REQUESTS.inc('won')
+                        return task.result()
+            # Оба запроса неудачны - решение о повторе принимается по первому
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def post_json(self, url: str, payload: Dict[str, Any], hedge: bool = False,
+                        deadline: Optional[float] = None, idempotent: bool = True) -> MiniMaxResponse:
+        """POST запрос с JSON телом к API Minimax.
+
+        Повторяет запрос при 429, 5xx и сетевых ошибках в пределах бюджета времени
+        (последний ответ с ошибкой возвращается как есть). hedge - запрос идемпотентен
+        и его можно продублировать. Неидемпотентный запрос (клонирование) повторяется,
+        только если он точно не выполнен: ошибка соединения или 429 с Retry-After.
+        CircuitOpen, если Minimax признан недоступным.
+        """
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            self.breaker.check()
+            attempt += 1
+            response: Optional[MiniMaxResponse] = None
+            retry_after: Optional[float] = None
+            try:
+                request = self._post_hedged(url, payload) if hedge and self.hedge_enabled else self._post(url, payload)
+                response = await asyncio.wait_for(request, max(expires - loop.time(), 0))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                error: Exception = e
+                reason = type(e).__name__
+            else:
+                if not _retryable(response.status):
+                    self.breaker.record_success()
+                    return response
+                # Ограничение частоты - не признак недоступности сервиса
+                if response.status != 429:
+                    self.breaker.record_failure()
+                retry_after = _retry_after(response)
+                reason = str(response.status)
+
+            delay = retry_after if retry_after is not None else random.uniform(
+                0, min(MINIMAX_BACKOFF_MAX, MINIMAX_BACKOFF_BASE * 2 ** (attempt - 1))
+            )
+            # Таймаут или 5xx после отправки: Minimax мог уже выполнить запрос (и списать оплату)
+            if idempotent:
+                safe = True
+            elif response is None:
+                safe = isinstance(error, _CONNECT_ERRORS)
+            else:
+                safe = response.status == 429 and retry_after is not None
+            if not safe or attempt >= self.max_attempts or loop.time() + delay >= expires:
+                if response is not None:
+                    return response
+                raise error
+            API_RETRIES.inc(reason)
+            logger.warning(f"MiniMax call failed ({reason}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def get_bytes(self, url: str) -> Tuple[int, bytes]:
+        """Скачивание бинарных данных (например, аудио по audio_url)"""
+        session = self._get_session()
+        async with self._get_inflight():
+            async with session.get(url) as response:
+                return response.status, await response.read()
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import logging
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+
+from transcode import decode_pcm, encode_mp3
+
+CLONE_SAMPLE_RATE = int(os.getenv('CLONE_SAMPLE_RATE', '24000'))
+CLONE_BITRATE = os.getenv('CLONE_BITRATE', '64k')
+SAMPLE_MIN_SECONDS = float(os.getenv('SAMPLE_MIN_SECONDS', '5'))
+SAMPLE_MAX_SECONDS = float(os.getenv('SAMPLE_MAX_SECONDS', '30'))
+# Кадры тише этого уровня (dBFS) считаются тишиной
+SILENCE_THRESHOLD_DB = float(os.getenv('SILENCE_THRESHOLD_DB', '-45'))
+# Образец, средний уровень которого ниже этого значения (dBFS), отклоняется
+SAMPLE_MIN_LEVEL_DB = float(os.getenv('SAMPLE_MIN_LEVEL_DB', '-40'))
+
+FRAME_MS = 20
+PADDING_MS = 150
+
+logger = logging.getLogger(__name__)
+
+
+class SampleRejected(Exception):
+    """Образец непригоден для клонирования; текст исключения показывается пользователю"""
+
+
+def _to_db(rms: np.ndarray) -> np.ndarray:
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def trim_and_clamp(pcm: bytes, sample_rate: int = CLONE_SAMPLE_RATE) -> Tuple[bytes, float]:
+    """Обрезка тишины по краям и ограничение длительности.
+
+    Принимает моно PCM s16le, возвращает обработанный PCM и его длительность в секундах.
+    Блокирующая функция - вызывать через asyncio.to_thread.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame = sample_rate * FRAME_MS // 1000
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        raise SampleRejected("❌ Образец слишком короткий")
+
+    # Энергия по кадрам одним векторным вычислением
+    frames = samples[:n_frames * frame].astype(np.float32).reshape(n_frames, frame) / 32768.0
+    frame_db = _to_db(np.sqrt(np.mean(frames * frames, axis=1)))
+
+    voiced = np.flatnonzero(frame_db > SILENCE_THRESHOLD_DB)
+    if len(voiced) == 0:
+        raise SampleRejected("❌ В образце не слышно речи. Запишите голос громче")
+
+    padding = PADDING_MS // FRAME_MS
+    start = max(int(voiced[0]) - padding, 0) * frame
+    end = min(int(voiced[-1]) + 1 + padding, n_frames) * frame
+    end = min(end, start + int(SAMPLE_MAX_SECONDS * sample_rate))
+    trimmed = samples[start:end]
+
+    duration = len(trimmed) / sample_rate
+    if duration < SAMPLE_MIN_SECONDS:
+        raise SampleRejected(
+            f"❌ Слишком мало речи в образце ({duration:.1f} с). "
+            f"Нужно не меньше {SAMPLE_MIN_SECONDS:g} секунд"
+        )
+
+    level = float(_to_db(np.sqrt(np.mean(np.square(trimmed.astype(np.float32) / 32768.0)))))
+    if level < SAMPLE_MIN_LEVEL_DB:
+        raise SampleRejected("❌ Образец слишком тихий. Запишите голос громче и ближе к микрофону")
+
+    return trimmed.tobytes(), duration
+
+
+async def prepare_sample(sample: BinaryIO) -> Optional[bytes]:
+    """Подготовка образца к клонированию: моно, нужная частота, без тишины, 5-30 с.
+
+    Возвращает MP3 или None, если ffmpeg недоступен (тогда загружается исходный файл).
+    Непригодные образцы вызывают SampleRejected.
+    """
+    pcm = await decode_pcm(sample, CLONE_SAMPLE_RATE)
+    if pcm is None:
+        return None
+
+    trimmed, duration = await asyncio.to_thread(trim_and_clamp, pcm)
+    encoded = await encode_mp3(trimmed, CLONE_SAMPLE_RATE, CLONE_BITRATE)
+    if encoded is None:
+        return None
+
+    logger.info(f"Sample prepared: {duration:.1f}s, {len(encoded)} bytes")
+    return encoded
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter as Tally
+from types import FrameType
+from typing import List, Optional, Tuple
+
+from metrics import LOOP_LAG, LOOP_BLOCKS
+
+LOOP_MONITOR_ENABLED = os.getenv('LOOP_MONITOR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))
+# Блокировка цикла событий дольше этого (секунды) логируется со стеком
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.25'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+logger = logging.getLogger(__name__)
+
+IDLE_FRAME = '(idle)'
+
+
+def _frames(frame: Optional[FrameType]) -> List[FrameType]:
+    """Кадры от внешнего к внутреннему"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _qualname(frame: FrameType) -> str:
+    code = frame.f_code
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+def handler_name(frame: Optional[FrameType], owner: str) -> Optional[str]:
+    """Самый внутренний метод класса owner в стеке - обработчик, который выполняется"""
+    prefix = owner + '.'
+    for item in reversed(_frames(frame)):
+        name = _qualname(item)
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return None
+
+
+def _is_idle(frame: FrameType) -> bool:
+    # Цикл событий ждет ввода-вывода в селекторе - ничего не выполняется
+    return frame.f_code.co_name in ('select', 'poll', 'epoll', 'kqueue') and 'selectors' in frame.f_code.co_filename
+
+
+class LoopMonitor:
+    """Измерение задержки цикла событий и поиск блокирующего кода.
+
+    Задача в цикле отмечается каждые LOOP_LAG_INTERVAL секунд; сторожевой поток,
+    не дождавшись отметки дольше порога, снимает стек потока цикла и пишет в лог,
+    какой обработчик владельца (owner) его занял.
+    """
+
+    def __init__(self, owner: str, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.owner = owner
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread: Optional[int] = None
+        self._beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(time.monotonic() - started - self.interval, 0.0))
+
+    def _watch(self):
+        reported = 0.0
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == reported:
+                continue
+            # Одна запись на каждую блокировку
+            reported = beat
+            frame = sys._current_frames().get(self.loop_thread)
+            handler = handler_name(frame, self.owner) or 'unknown'
+            LOOP_BLOCKS.inc(handler)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            logger.warning(f"Event loop blocked for {blocked:.2f}s in handler {handler}:\n{stack}")
+
+    def start(self):
+        """Запуск из работающего цикла событий"""
+        self.loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик потока цикла событий: стек снимается каждые interval
+    секунд из отдельного потока, результат - свернутые стеки (формат flamegraph.pl и speedscope).
+    """
+
+    def __init__(self, thread_id: int, owner: str, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.owner = owner
+        self.interval = interval
+        self.stacks: Tally = Tally()
+        self.handlers: Tally = Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    @staticmethod
+    def _label(frame: FrameType) -> str:
+        return f"{_qualname(frame)} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})"
+
+    def run(self, seconds: float):
+        """Сбор выборок до истечения времени или stop(). Блокирующий - вызывать через asyncio.to_thread"""
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.samples += 1
+            if _is_idle(frame):
+                self.stacks[IDLE_FRAME] += 1
+                continue
+            self.stacks[';'.join(self._label(item) for item in _frames(frame))] += 1
+            self.handlers[handler_name(frame, self.owner) or 'other'] += 1
+        self._stop.set()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 5) -> Tuple[float, List[Tuple[str, int]]]:
+        """Доля простоя и самые загруженные обработчики"""
+        idle = self.stacks.get(IDLE_FRAME, 0) / self.samples if self.samples else 0.0
+        return idle, self.handlers.most_common(top)
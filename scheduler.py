@@ -0,0 +1,212 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', '8'))
+SCHEDULER_MAX_QUEUE = int(os.getenv('SCHEDULER_MAX_QUEUE', '200'))
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Очередь заданий заполнена - пользователю нужно попробовать позже"""
+
+
+class JobCancelled(Exception):
+    """Ожидание отменено пользователем (/cancel)"""
+
+
+class Job:
+    """Задание генерации; одинаковые задания разных запросов объединяются"""
+
+    __slots__ = ('key', 'owner', 'factory', 'tickets', 'task')
+
+    def __init__(self, key: str, owner: int, factory: Callable[[], Awaitable[Any]]):
+        self.key = key
+        self.owner = owner
+        self.factory = factory
+        self.tickets: List['Ticket'] = []
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+
+class Ticket:
+    """Ожидание результата задания одним запросом пользователя"""
+
+    __slots__ = ('job', 'user_id', 'future')
+
+    def __init__(self, job: Job, user_id: int):
+        self.job = job
+        self.user_id = user_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """Планировщик обращений к Minimax: общий лимит параллельности,
+    поочередное обслуживание пользователей, объединение одинаковых заданий,
+    ограниченная очередь и отмена по /cancel.
+    """
+
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._jobs: Dict[str, Job] = {}
+        # Очереди пользователей в порядке обслуживания (round-robin)
+        self._queues: 'OrderedDict[int, Deque[Job]]' = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        # Сколько заданий создано за все время (объединенные с готовыми не считаются)
+        self.created = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def is_pending(self, user_id: int, key: str) -> bool:
+        """Пользователь уже ждет такое же задание (например, двойное нажатие)"""
+        job = self._jobs.get(key)
+        return job is not None and any(ticket.user_id == user_id for ticket in job.tickets)
+
+    def submit(self, user_id: int, key: str, factory: Callable[[], Awaitable[Any]]) -> Ticket:
+        """Постановка задания в очередь; одинаковое задание в работе переиспользуется"""
+        job = self._jobs.get(key)
+        if job is None:
+            if self._queued >= self.max_queue:
+                raise QueueFull()
+            job = Job(key, user_id, factory)
+            self.created += 1
+            self._jobs[key] = job
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._queued += 1
+
+        ticket = Ticket(job, user_id)
+        job.tickets.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Позиция в очереди (0 - задание уже выполняется)"""
+        job = ticket.job
+        if job.running:
+            return 0
+        queue = self._queues.get(job.owner)
+        if queue is None or job not in queue:
+            return 0
+        index = queue.index(job)
+        ahead = index
+        # Пользователи впереди по кругу получают на одно задание больше
+        before = True
+        for user_id, other in self._queues.items():
+            if user_id == job.owner:
+                before = False
+                continue
+            ahead += min(len(other), index + 1 if before else index)
+        return ahead + 1
+
+    async def wait(self, ticket: Ticket) -> Any:
+        """Ожидание результата; JobCancelled, если ожидание отменено через cancel_user"""
+        try:
+            return await asyncio.shield(ticket.future)
+        except asyncio.CancelledError:
+            if ticket.future.cancelled() and not asyncio.current_task().cancelling():
+                raise JobCancelled()
+            # Отменен сам обработчик - результат ему больше не нужен
+            self._unsubscribe(ticket)
+            raise
+
+    def cancel(self, ticket: Ticket):
+        """Отмена одного ожидания; задание без ожидающих останавливается"""
+        self._unsubscribe(ticket)
+
+    def cancel_user(self, user_id: int) -> int:
+        """Отмена всех ожиданий пользователя; задания без ожидающих останавливаются.
+
+        Вызывается из /cancel, который обрабатывается параллельно с ожидающими
+        обработчиками (см. PerUserUpdateProcessor в dispatch.py).
+        """
+        tickets = [
+            ticket
+            for job in list(self._jobs.values())
+            for ticket in job.tickets
+            if ticket.user_id == user_id
+        ]
+        for ticket in tickets:
+            self._unsubscribe(ticket)
+        return len(tickets)
+
+    def _unsubscribe(self, ticket: Ticket):
+        job = ticket.job
+        if ticket in job.tickets:
+            job.tickets.remove(ticket)
+            if not job.tickets:
+                self._drop(job)
+        ticket.future.cancel()
+
+    async def close(self):
+        for job in list(self._jobs.values()):
+            for ticket in job.tickets:
+                ticket.future.cancel()
+            job.tickets.clear()
+            self._drop(job)
+
+    def _drop(self, job: Job):
+        """Остановка задания, результат которого больше никому не нужен"""
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        if job.running:
+            job.task.cancel()
+            return
+        queue = self._queues.get(job.owner)
+        if queue is not None and job in queue:
+            queue.remove(job)
+            self._queued -= 1
+            if not queue:
+                del self._queues[job.owner]
+
+    def _next_job(self) -> Optional[Job]:
+        if not self._queues:
+            return None
+        user_id, queue = self._queues.popitem(last=False)
+        job = queue.popleft()
+        self._queued -= 1
+        if queue:
+            # Пользователь уходит в конец круга
+            self._queues[user_id] = queue
+        return job
+
+    def _dispatch(self):
+        while self._running < self.concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running += 1
+            job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Job):
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            for ticket in job.tickets:
+                ticket.future.cancel()
+        except Exception as e:
+            for ticket in job.tickets:
+                if not ticket.future.done():
+                    ticket.future.set_exception(e)
+        else:
+            for ticket in job.tickets:
+                if not ticket.future.done():
+                    ticket.future.set_result(result)
+        finally:
+            self._running -= 1
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            self._dispatch()
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_DB = os.getenv('SESSION_DB', os.path.join(os.getcwd(), 'cache', 'sessions.sqlite3'))
+SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+SESSION_TTL = int(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '50000'))
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Состояние диалога с пользователем"""
+
+    __slots__ = ('step', 'voice_id', 'text', 'text_at', 'last_style', 'updated_at')
+
+    def __init__(self, step: str = 'start', voice_id: Optional[str] = None,
+                 text: Optional[str] = None, text_at: Optional[float] = None,
+                 last_style: Optional[str] = None, updated_at: Optional[float] = None):
+        self.step = step
+        self.voice_id = voice_id
+        self.text = text
+        # Время отправки последнего фрагмента текста (для склейки длинного текста)
+        self.text_at = text_at
+        # Последняя выбранная кнопка стиля
+        self.last_style = last_style
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Session':
+        session = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(session, name, data[name])
+        return session
+
+    def __repr__(self):
+        return f"Session({self.to_dict()})"
+
+
+class SessionBackend:
+    """Постоянное хранилище сессий (общее для нескольких процессов бота)"""
+
+    async def load(self, user_id: int) -> Optional[Session]:
+        raise NotImplementedError
+
+    async def save(self, user_id: int, session: Session):
+        raise NotImplementedError
+
+    async def delete(self, user_id: int):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Сессии в локальной базе SQLite"""
+
+    def __init__(self, db_path: str = SESSION_DB, ttl: int = SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id INTEGER PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _run(self, func, *args):
+        with self._lock:
+            return func(self._connect(), *args)
+
+    def _load(self, conn: sqlite3.Connection, user_id: int) -> Optional[Session]:
+        row = conn.execute(
+            "SELECT data FROM sessions WHERE user_id = ? AND updated_at >= ?",
+            (user_id, time.time() - self.ttl)
+        ).fetchone()
+        return Session.from_dict(json.loads(row[0])) if row else None
+
+    def _save(self, conn: sqlite3.Connection, user_id: int, session: Session):
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(session.to_dict(), separators=(',', ':')), session.updated_at)
+        )
+        # Устаревшие записи удаляем время от времени, а не при каждой записи
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        conn.commit()
+
+    def _delete(self, conn: sqlite3.Connection, user_id: Optional[int]):
+        if user_id is None:
+            conn.execute("DELETE FROM sessions")
+        else:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+    async def load(self, user_id: int) -> Optional[Session]:
+        return await asyncio.to_thread(self._run, self._load, user_id)
+
+    async def save(self, user_id: int, session: Session):
+        await asyncio.to_thread(self._run, self._save, user_id, session)
+
+    async def delete(self, user_id: int):
+        await asyncio.to_thread(self._run, self._delete, user_id)
+
+    async def clear(self):
+        await asyncio.to_thread(self._run, self._delete, None)
+
+    async def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisSessionBackend(SessionBackend):
+    """Сессии в Redis (или любом сервере с протоколом Redis); TTL задается на ключе"""
+
+    def __init__(self, url: str = SESSION_REDIS_URL, ttl: int = SESSION_TTL, prefix: str = 'voicebot:session:'):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def load(self, user_id: int) -> Optional[Session]:
+        data = await self._redis.get(f"{self.prefix}{user_id}")
+        return Session.from_dict(json.loads(data)) if data else None
+
+    async def save(self, user_id: int, session: Session):
+        data = json.dumps(session.to_dict(), separators=(',', ':'))
+        await self._redis.set(f"{self.prefix}{user_id}", data, ex=self.ttl)
+
+    async def delete(self, user_id: int):
+        await self._redis.delete(f"{self.prefix}{user_id}")
+
+    async def clear(self):
+        keys = [key async for key in self._redis.scan_iter(match=f"{self.prefix}*", count=500)]
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class SessionStore:
+    """Сессии пользователей: ограниченный LRU в памяти с вытеснением по простою
+    и необязательным постоянным хранилищем (запись сквозная).
+
+    Обновления одного пользователя должны обрабатываться одним процессом,
+    иначе копия в памяти может устареть.
+    """
+
+    def __init__(self, backend: Optional[SessionBackend] = None,
+                 max_entries: int = SESSION_MAX_ENTRIES, idle_ttl: int = SESSION_TTL):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._sessions: 'OrderedDict[int, Session]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        now = time.time()
+        session = self._sessions.get(user_id)
+        if session is not None:
+            if now - session.updated_at > self.idle_ttl:
+                del self._sessions[user_id]
+                return None
+            session.updated_at = now
+            self._sessions.move_to_end(user_id)
+            return session
+
+        if self.backend is None:
+            return None
+        session = await self.backend.load(user_id)
+        if session is not None:
+            session.updated_at = now
+            self._remember(user_id, session)
+        return session
+
+    async def save(self, user_id: int, session: Session):
+        session.updated_at = time.time()
+        self._remember(user_id, session)
+        if self.backend is not None:
+            await self.backend.save(user_id, session)
+
+    async def delete(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        if self.backend is not None:
+            await self.backend.delete(user_id)
+
+    async def clear(self):
+        self._sessions.clear()
+        if self.backend is not None:
+            await self.backend.clear()
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+    def _remember(self, user_id: int, session: Session):
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self):
+        # Самые давние по активности сессии находятся в начале
+        deadline = time.time() - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_entries or session.updated_at < deadline:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+
+def create_session_store() -> SessionStore:
+    """Хранилище сессий по настройке SESSION_BACKEND (memory, sqlite, redis)"""
+    if SESSION_BACKEND == 'sqlite':
+        backend = SQLiteSessionBackend()
+    elif SESSION_BACKEND == 'redis':
+        backend = RedisSessionBackend()
+    else:
+        backend = None
+    return SessionStore(backend)
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from scheduler import JobScheduler, QueueFull, Ticket
+from metrics import SPECULATION
+
+SPECULATIVE_ENABLED = os.getenv('SPECULATIVE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Доля заданий Minimax, которую могут занять неугаданные предварительные задания
+# (и доля слотов планировщика, которую они занимают одновременно)
+SPECULATIVE_BUDGET_SHARE = float(os.getenv('SPECULATIVE_BUDGET_SHARE', '0.25'))
+SPECULATIVE_MAX_ENTRIES = int(os.getenv('SPECULATIVE_MAX_ENTRIES', '1000'))
+# Сколько секунд хранится готовый результат догадки; позже куски берутся из кэша аудио
+SPECULATIVE_TTL = float(os.getenv('SPECULATIVE_TTL', '30'))
+
+logger = logging.getLogger(__name__)
+
+
+class Speculator:
+    """Предварительный синтез вероятного стиля, пока пользователь выбирает кнопку.
+
+    Задание идет через общий планировщик от имени пользователя; при выборе того же
+    стиля обработчик кнопки забирает его билет, при другом выборе задание отменяется.
+
+    Бюджет - корзина токенов: каждое настоящее задание планировщика (и угаданная догадка)
+    добавляет share / (1 - share) токена, догадка тратит один. Так неугаданные догадки
+    занимают не больше share всех заданий; запас корзины - limit догадок.
+    """
+
+    def __init__(self, scheduler: JobScheduler, enabled: bool = SPECULATIVE_ENABLED,
+                 budget_share: float = SPECULATIVE_BUDGET_SHARE, max_entries: int = SPECULATIVE_MAX_ENTRIES,
+                 ttl: float = SPECULATIVE_TTL):
+        self.scheduler = scheduler
+        self.enabled = enabled and budget_share > 0
+        self.limit = max(1, int(scheduler.concurrency * budget_share))
+        self._rate = budget_share / (1 - budget_share) if budget_share < 1 else float(self.limit)
+        self._tokens = float(self.limit)
+        self._created_seen = scheduler.created
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # user_id -> (ключ задания, билет)
+        self._entries: 'OrderedDict[int, Tuple[str, Ticket]]' = OrderedDict()
+        self._active = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def start(self, user_id: int, key: str, factory: Callable[[], Awaitable[Any]]) -> bool:
+        """Запуск предварительного задания, если позволяет бюджет"""
+        self.drop(user_id)
+        if not self.enabled or self.scheduler.is_pending(user_id, key):
+            return False
+        # Реальные запросы в очереди важнее догадок
+        if self._active >= self.limit or self.scheduler.queued:
+            SPECULATION.inc('skipped')
+            return False
+        self._refill()
+        if self._tokens < 1:
+            SPECULATION.inc('over_budget')
+            return False
+        try:
+            ticket = self.scheduler.submit(user_id, key, factory)
+        except QueueFull:
+            SPECULATION.inc('skipped')
+            return False
+        # Свое задание не считается настоящим
+        if self.scheduler.created != self._created_seen:
+            self._created_seen = self.scheduler.created
+            self._tokens -= 1
+
+        self._active += 1
+        ticket.future.add_done_callback(lambda future: self._finished(user_id, ticket))
+        self._entries[user_id] = (key, ticket)
+        while len(self._entries) > self.max_entries:
+            _, (_, oldest) = self._entries.popitem(last=False)
+            self.scheduler.cancel(oldest)
+        SPECULATION.inc('started')
+        return True
+
+    def _refill(self):
+        created = self.scheduler.created - self._created_seen
+        self._created_seen = self.scheduler.created
+        self._tokens = min(self._tokens + created * self._rate, float(self.limit))
+
+    def _finished(self, user_id: int, ticket: Ticket):
+        self._active -= 1
+        if ticket.future.cancelled():
+            return
+        # Ошибку заберет обработчик кнопки, а если он не придет - не засоряем лог
+        ticket.future.exception()
+        # Готовый результат (несколько МБ аудио) не держим до следующего текста
+        asyncio.get_running_loop().call_later(self.ttl, self._expire, user_id, ticket)
+
+    def _expire(self, user_id: int, ticket: Ticket):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] is ticket:
+            del self._entries[user_id]
+            SPECULATION.inc('expired')
+
+    def take(self, user_id: int, key: str) -> Optional[Ticket]:
+        """Билет готового или выполняющегося задания для выбранного стиля; иначе отмена догадки"""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return None
+        speculative_key, ticket = entry
+        if speculative_key == key and not ticket.future.cancelled():
+            SPECULATION.inc('hit')
+            # Угаданная догадка - полезное задание: токен возвращается с прибавкой
+            self._tokens = min(self._tokens + 1 + self._rate, float(self.limit))
+            return ticket
+        SPECULATION.inc('miss')
+        self.scheduler.cancel(ticket)
+        return None
+
+    def drop(self, user_id: int):
+        """Отмена догадки (новый текст, /cancel)"""
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            SPECULATION.inc('dropped')
+            self.scheduler.cancel(entry[1])
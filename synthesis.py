@@ -0,0 +1,145 @@
+import io
+import os
+import re
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from pydub import AudioSegment
+
+from transcode import OPUS_BITRATE
+
+MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', '20000'))
+# Telegram делит длинный текст на сообщения до 4096 символов; фрагмент, пришедший
+# в пределах окна (секунды) после длинного сообщения, дописывается к нему
+TEXT_JOIN_WINDOW = float(os.getenv('TEXT_JOIN_WINDOW', '3'))
+TEXT_JOIN_MIN_CHARS = int(os.getenv('TEXT_JOIN_MIN_CHARS', '3500'))
+TTS_CHUNK_CHARS = int(os.getenv('TTS_CHUNK_CHARS', '400'))
+TTS_CONCURRENCY = int(os.getenv('TTS_CONCURRENCY', '4'))
+TTS_CROSSFADE_MS = int(os.getenv('TTS_CROSSFADE_MS', '30'))
+# Длинный результат делится на несколько голосовых сообщений такой длительности
+VOICE_MESSAGE_MAX_SECONDS = int(os.getenv('VOICE_MESSAGE_MAX_SECONDS', '600'))
+
+logger = logging.getLogger(__name__)
+
+# Закрывающие кавычки и скобки остаются в предложении (просмотр назад фиксированной ширины)
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?…])|(?<=[.!?…]["»)\]]))\s+')
+_CLAUSE_END = re.compile(r'(?<=[,;:—–])\s+')
+
+
+def _pack(pieces: List[str], max_chars: int) -> List[str]:
+    """Склеивание соседних фрагментов в куски не длиннее max_chars"""
+    chunks: List[str] = []
+    current = ''
+    for piece in pieces:
+        if not current:
+            current = piece
+        elif len(current) + 1 + len(piece) <= max_chars:
+            current = f"{current} {piece}"
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_long(piece: str, max_chars: int) -> List[str]:
+    """Дробление слишком длинного предложения: по частям фразы, словам, затем жестко"""
+    if len(piece) <= max_chars:
+        return [piece]
+    for pattern in (_CLAUSE_END, re.compile(r'\s+')):
+        parts = [p for p in pattern.split(piece) if p]
+        if len(parts) > 1:
+            result: List[str] = []
+            for part in _pack(parts, max_chars):
+                result.extend(_split_long(part, max_chars))
+            return result
+    return [piece[i:i + max_chars] for i in range(0, len(piece), max_chars)]
+
+
+def split_text(text: str, max_chars: int = TTS_CHUNK_CHARS) -> List[str]:
+    """Разбиение текста на куски по границам предложений и фраз"""
+    pieces: List[str] = []
+    for paragraph in text.splitlines():
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            sentence = sentence.strip()
+            if sentence:
+                pieces.extend(_split_long(sentence, max_chars))
+    return _pack(pieces, max_chars)
+
+
+def _export(segment: AudioSegment, output_format: str) -> bytes:
+    out = io.BytesIO()
+    if output_format == 'opus':
+        # Сразу голосовое сообщение Telegram: OGG/Opus, моно
+        segment.export(out, format='ogg', codec='libopus', bitrate=OPUS_BITRATE,
+                       parameters=['-ac', '1', '-application', 'voip'])
+    else:
+        segment.export(out, format=output_format)
+    return out.getvalue()
+
+
+def stitch_audio(parts: List[bytes], crossfade_ms: int = TTS_CROSSFADE_MS,
+                 max_seconds: int = VOICE_MESSAGE_MAX_SECONDS, audio_format: str = 'mp3',
+                 output_format: str = 'mp3') -> Tuple[List[bytes], str]:
+    """Склейка кусков аудио по порядку с короткими кроссфейдами.
+
+    Возвращает одно или несколько сообщений не длиннее max_seconds и их формат:
+    output_format ('opus' - OGG/Opus) или audio_format, если склейка не понадобилась
+    или аудио не удалось декодировать. Блокирующая функция - вызывать через asyncio.to_thread.
+    """
+    if len(parts) == 1:
+        return parts, audio_format
+
+    try:
+        segments = [AudioSegment.from_file(io.BytesIO(part), format=audio_format) for part in parts]
+    except Exception as e:
+        # Без ffmpeg кадры MP3 можно склеить как есть, без кроссфейда
+        logger.warning(f"Cannot decode audio for stitching, concatenating raw: {e}")
+        return [b''.join(parts)], audio_format
+
+    max_ms = max_seconds * 1000
+    messages: List[AudioSegment] = []
+    current: Optional[AudioSegment] = None
+    for segment in segments:
+        if current is None:
+            current = segment
+        elif len(current) + len(segment) > max_ms:
+            messages.append(current)
+            current = segment
+        else:
+            fade = min(crossfade_ms, len(current), len(segment))
+            current = current.append(segment, crossfade=fade)
+    messages.append(current)
+
+    try:
+        return [_export(message, output_format) for message in messages], output_format
+    except Exception as e:
+        if output_format == audio_format:
+            raise
+        logger.warning(f"Cannot export stitched audio as {output_format}: {e}")
+        return [_export(message, audio_format) for message in messages], audio_format
+
+
+async def synthesize_chunks(chunks: List[str], synthesize: Callable[[str], Awaitable[Optional[bytes]]],
+                            concurrency: int = TTS_CONCURRENCY) -> Optional[List[bytes]]:
+    """Параллельный синтез кусков с ограничением числа одновременных запросов.
+
+    Возвращает аудио в исходном порядке или None, если хотя бы один кусок не удался.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: str) -> Optional[bytes]:
+        async with semaphore:
+            return await synthesize(chunk)
+
+    tasks = [asyncio.create_task(run(chunk)) for chunk in chunks]
+    try:
+        for task in asyncio.as_completed(tasks):
+            if not await task:
+                return None
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,122 @@
+import os
+import asyncio
+import logging
+from typing import BinaryIO, List, Optional, Union
+
+from media import iter_chunks
+
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+OPUS_ENABLED = os.getenv('OPUS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+OPUS_BITRATE = os.getenv('OPUS_BITRATE', '32k')
+TRANSCODE_CONCURRENCY = int(os.getenv('TRANSCODE_CONCURRENCY', str(os.cpu_count() or 2)))
+TRANSCODE_TIMEOUT = float(os.getenv('TRANSCODE_TIMEOUT', '60'))
+
+logger = logging.getLogger(__name__)
+
+_semaphore: Optional[asyncio.Semaphore] = None
+_ffmpeg_missing = False
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+    return _semaphore
+
+
+async def _feed(stdin: asyncio.StreamWriter, source: Union[bytes, BinaryIO]):
+    """Потоковая запись входных данных в stdin ffmpeg"""
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            stdin.write(source)
+            await stdin.drain()
+        else:
+            for chunk in iter_chunks(source):
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg завершился раньше - причину покажет stderr
+        pass
+    finally:
+        stdin.close()
+
+
+async def run_ffmpeg(args: List[str], source: Union[bytes, BinaryIO]) -> Optional[bytes]:
+    """Запуск ffmpeg с передачей данных через stdin/stdout, без временных файлов.
+
+    Возвращает stdout или None, если ffmpeg недоступен или завершился с ошибкой.
+    """
+    global _ffmpeg_missing
+    if _ffmpeg_missing:
+        return None
+
+    async with _get_semaphore():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            logger.warning(f"{FFMPEG_BINARY} not found, audio processing disabled")
+            _ffmpeg_missing = True
+            return None
+
+        try:
+            _, stdout, stderr = await asyncio.wait_for(
+                asyncio.gather(
+                    _feed(process.stdin, source),
+                    process.stdout.read(),
+                    process.stderr.read()
+                ),
+                TRANSCODE_TIMEOUT
+            )
+            await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.error("ffmpeg timed out")
+            return None
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+
+    if process.returncode != 0 or not stdout:
+        logger.error(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+        return None
+
+    return stdout
+
+
+async def to_ogg_opus(audio_data: bytes, input_format: str = 'mp3', bitrate: str = OPUS_BITRATE) -> bytes:
+    """Перекодирование в OGG/Opus для голосовых сообщений Telegram.
+
+    При ошибке возвращается исходное аудио.
+    """
+    if not OPUS_ENABLED:
+        return audio_data
+
+    result = await run_ffmpeg([
+        '-f', input_format, '-i', 'pipe:0',
+        '-map_metadata', '-1', '-vn', '-ac', '1',
+        '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip',
+        '-f', 'ogg', 'pipe:1'
+    ], audio_data)
+    return result or audio_data
+
+
+async def decode_pcm(source: Union[bytes, BinaryIO], sample_rate: int) -> Optional[bytes]:
+    """Декодирование любого формата в моно PCM s16le с заданной частотой"""
+    return await run_ffmpeg([
+        '-i', 'pipe:0', '-vn', '-ac', '1', '-ar', str(sample_rate),
+        '-f', 's16le', 'pipe:1'
+    ], source)
+
+
+async def encode_mp3(pcm: bytes, sample_rate: int, bitrate: str = '64k') -> Optional[bytes]:
+    """Кодирование моно PCM s16le в MP3"""
+    return await run_ffmpeg([
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+        '-c:a', 'libmp3lame', '-b:a', bitrate, '-f', 'mp3', 'pipe:1'
+    ], pcm)
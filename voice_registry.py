@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+VOICE_REGISTRY_DB = os.getenv('VOICE_REGISTRY_DB', os.path.join(os.getcwd(), 'cache', 'voices.sqlite3'))
+VOICE_REGISTRY_TTL = int(os.getenv('VOICE_REGISTRY_TTL', str(30 * 24 * 3600)))
+VOICE_REGISTRY_MAX_ENTRIES = int(os.getenv('VOICE_REGISTRY_MAX_ENTRIES', '100000'))
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceRegistry:
+    """Постоянное соответствие образец -> voice_id Minimax (SQLite)"""
+
+    def __init__(self, db_path: str = VOICE_REGISTRY_DB,
+                 ttl: int = VOICE_REGISTRY_TTL,
+                 max_entries: int = VOICE_REGISTRY_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS voices ("
+                " fingerprint TEXT PRIMARY KEY,"
+                " file_unique_id TEXT,"
+                " user_id INTEGER NOT NULL,"
+                " voice_id TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS voices_file_unique_id ON voices (file_unique_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS voices_user_id ON voices (user_id, last_used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS voices_last_used_at ON voices (last_used_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _run(self, func, *args):
+        with self._lock:
+            return func(self._connect(), *args)
+
+    # ---------- Синхронные операции (выполняются в потоке) ----------
+
+    def _lookup(self, conn: sqlite3.Connection, column: str, value) -> Optional[str]:
+        now = time.time()
+        row = conn.execute(
+            f"SELECT fingerprint, voice_id FROM voices WHERE {column} = ? AND last_used_at >= ? "
+            "ORDER BY last_used_at DESC LIMIT 1",
+            (value, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE voices SET last_used_at = ? WHERE fingerprint = ?", (now, row[0]))
+        conn.commit()
+        return row[1]
+
+    def _register(self, conn: sqlite3.Connection, fingerprint: str, file_unique_id: Optional[str],
+                  user_id: int, voice_id: str):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO voices "
+            "(fingerprint, file_unique_id, user_id, voice_id, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (fingerprint, file_unique_id, user_id, voice_id, now, now)
+        )
+        self._evict(conn, now)
+        conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM voices WHERE last_used_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM voices WHERE fingerprint IN ("
+            " SELECT fingerprint FROM voices ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def _purge(self, conn: sqlite3.Connection, user_id: Optional[int]) -> int:
+        if user_id is None:
+            cursor = conn.execute("DELETE FROM voices")
+        else:
+            cursor = conn.execute("DELETE FROM voices WHERE user_id = ?", (user_id,))
+        conn.commit()
+        return cursor.rowcount
+
+    def _forget(self, conn: sqlite3.Connection, voice_id: str) -> int:
+        cursor = conn.execute("DELETE FROM voices WHERE voice_id = ?", (voice_id,))
+        conn.commit()
+        return cursor.rowcount
+
+    def _count(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COUNT(*) FROM voices").fetchone()[0]
+
+    # ---------- Асинхронный интерфейс ----------
+
+    async def find_by_file(self, file_unique_id: str) -> Optional[str]:
+        """voice_id по Telegram file_unique_id образца"""
+        return await asyncio.to_thread(self._run, self._lookup, 'file_unique_id', file_unique_id)
+
+    async def find_by_fingerprint(self, fingerprint: str) -> Optional[str]:
+        """voice_id по хэшу содержимого образца"""
+        return await asyncio.to_thread(self._run, self._lookup, 'fingerprint', fingerprint)
+
+    async def find_by_user(self, user_id: int) -> Optional[str]:
+        """Последний голос пользователя (например, после перезапуска бота)"""
+        return await asyncio.to_thread(self._run, self._lookup, 'user_id', user_id)
+
+    async def register(self, fingerprint: str, file_unique_id: Optional[str], user_id: int, voice_id: str):
+        await asyncio.to_thread(self._run, self._register, fingerprint, file_unique_id, user_id, voice_id)
+
+    async def purge(self, user_id: Optional[int] = None) -> int:
+        """Удаление записей пользователя или всего реестра"""
+        return await asyncio.to_thread(self._run, self._purge, user_id)
+
+    async def forget(self, voice_id: str) -> int:
+        """Удаление голоса, который Minimax больше не принимает: образец клонируется заново"""
+        return await asyncio.to_thread(self._run, self._forget, voice_id)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._run, self._count)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
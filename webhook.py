@@ -0,0 +1,233 @@
+import os
+import json
+import bisect
+import functools
+import asyncio
+import signal
+import hashlib
+import logging
+import multiprocessing
+from queue import Full
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 1)))
+# Очередь необработанных обновлений на процесс
+WEBHOOK_WORKER_QUEUE = int(os.getenv('WEBHOOK_WORKER_QUEUE', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Консистентное хэширование: пользователь всегда попадает в один процесс"""
+
+    def __init__(self, nodes: List[int], replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def node_for(self, key: int) -> int:
+        index = bisect.bisect(self._keys, self._hash(str(key))) % len(self._keys)
+        return self._ring[index][1]
+
+
+def update_user_id(data: Dict[str, Any]) -> int:
+    """id пользователя (или чата) из JSON обновления Telegram"""
+    for name, value in data.items():
+        if name == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return 0
+
+
+def purge_target(data: Dict[str, Any]) -> Optional[Union[int, str]]:
+    """Цель команды /purge_voices <user_id|all> из JSON обновления, иначе None"""
+    message = data.get('message')
+    parts = message.get('text', '').split() if isinstance(message, dict) else []
+    if len(parts) != 2 or parts[0].split('@')[0] != '/purge_voices':
+        return None
+    if parts[1] == 'all':
+        return 'all'
+    return int(parts[1]) if parts[1].isdigit() else None
+
+
+@functools.lru_cache(maxsize=None)
+def _ring(workers: int) -> HashRing:
+    return HashRing(list(range(workers)))
+
+
+def worker_owns(user_id: int) -> bool:
+    """Сессии пользователя хранятся в этом процессе"""
+    workers = worker_count()
+    return workers == 1 or _ring(workers).node_for(user_id) == int(os.getenv('BOT_WORKER_INDEX', '0'))
+
+
+def worker_count() -> int:
+    """Число процессов-обработчиков (1 в режиме polling)"""
+    return max(int(os.getenv('BOT_WORKERS', '1')), 1)
+
+
+def worker_share(limit: int) -> int:
+    """Доля общего лимита на один процесс: лимиты Minimax задаются на всех"""
+    return max(limit // worker_count(), 1)
+
+
+def worker_dir(path: str) -> str:
+    """Отдельный каталог процесса: размер каталога учитывает только его владелец"""
+    if worker_count() == 1:
+        return path
+    return f"{path.rstrip(os.sep)}-worker{os.getenv('BOT_WORKER_INDEX', '0')}"
+
+
+def _run_worker(index: int, workers: int, queue: multiprocessing.Queue,
+                build_application: Callable[[], Application]):
+    """Процесс-обработчик: принимает обновления из очереди маршрутизатора"""
+    # Остановкой процессов управляет маршрутизатор (через None в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Номер процесса используется, например, для порта метрик и каталога кэша
+    os.environ['BOT_WORKER_INDEX'] = str(index)
+    os.environ['BOT_WORKERS'] = str(workers)
+    asyncio.run(_worker_main(index, queue, build_application))
+
+
+async def _worker_main(index: int, queue: multiprocessing.Queue, build_application: Callable[[], Application]):
+    application = build_application()
+    loop = asyncio.get_running_loop()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logger.info(f"Webhook worker {index} started (pid {os.getpid()})")
+
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            try:
+                update = Update.de_json(json.loads(raw), application.bot)
+            except Exception as e:
+                logger.error(f"Cannot decode update: {e}")
+                continue
+            await application.update_queue.put(update)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class WebhookRouter:
+    """Прием webhook от Telegram и распределение обновлений по процессам"""
+
+    def __init__(self, build_application: Callable[[], Application], token: str,
+                 workers: int = WEBHOOK_WORKERS, secret: str = WEBHOOK_SECRET):
+        self.build_application = build_application
+        self.token = token
+        self.secret = secret
+        self.ring = _ring(workers)
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[Optional[multiprocessing.Process]] = []
+        for _ in range(workers):
+            self._queues.append(self._context.Queue(WEBHOOK_WORKER_QUEUE))
+            self._processes.append(None)
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(index, len(self._queues), self._queues[index], self.build_application),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def _supervise(self):
+        """Перезапуск упавших процессов"""
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self._start_worker(index)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=403)
+
+        raw = await request.read()
+        try:
+            data = json.loads(raw)
+            user_id = update_user_id(data)
+            target = purge_target(data)
+        except (ValueError, AttributeError):
+            return web.Response(status=400)
+
+        # Сессии в памяти есть только у процесса пользователя: очистка идет туда,
+        # а очистка всех - в каждый процесс
+        if target == 'all':
+            indexes = list(range(len(self._queues)))
+        else:
+            indexes = [self.ring.node_for(target if target is not None else user_id)]
+        for index in indexes:
+            try:
+                self._queues[index].put_nowait(raw)
+            except Full:
+                # Процесс не успевает - Telegram повторит доставку позже
+                logger.warning(f"Worker {index} queue is full")
+                return web.Response(status=503)
+        return web.Response()
+
+    async def _on_startup(self, app: web.Application):
+        for index in range(len(self._processes)):
+            self._start_worker(index)
+        app['supervisor'] = asyncio.create_task(self._supervise())
+
+        if WEBHOOK_URL:
+            async with Bot(self.token) as bot:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=self.secret or None,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            logger.info(f"Webhook set to {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}")
+
+    async def _on_cleanup(self, app: web.Application):
+        app['supervisor'].cancel()
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                await asyncio.to_thread(process.join, 30)
+                if process.is_alive():
+                    process.terminate()
+
+    def run(self, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        logger.info(f"Webhook router on {listen}:{port}{WEBHOOK_PATH}, {len(self._processes)} workers")
+        web.run_app(app, host=listen, port=port, print=None)